@@ -1,13 +1,34 @@
+# Cooperative sockets and locks for the eventlet server; must run before other imports.
+# EVENTLET_PATCH=0 keeps the stdlib untouched (e.g. for scripts and debuggers).
 import os
+if os.environ.get('EVENTLET_PATCH', '1') != '0':
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+    except ImportError:
+        pass
+
 import json
 import tempfile
-from flask import Flask, render_template, request, jsonify, session, Response
+import math
+import random
+import time
+import mimetypes
+from flask import Flask, render_template, request, jsonify, session, Response, send_file, g
+from werkzeug.formparser import parse_form_data
 from flask_socketio import SocketIO
-from audio_engine import download_audio, analyze_audio
-from game_engine import generate_beat_map, map_lyrics_to_beats, calculate_difficulty
-from lyrics_engine import get_lyrics, save_lyrics
-from models import db, Song
-from sqlalchemy.orm import defer
+from audio_engine import download_audio, analyze_audio, load_audio, fingerprint_audio, hash_file, upload_stream_factory, audio_mimetype, UPLOAD_EXTENSIONS
+from fingerprint_engine import band_keys, is_near_duplicate, similarity, confirm_duplicate
+from game_engine import generate_beat_map, map_lyrics_to_beats, calculate_difficulty, compute_strain, get_beat_map_strain, build_rhythm_grid, get_tier_notes, playable_content, build_note_index, note_window, NOTE_WINDOW, MAX_NOTE_WINDOW, note_patch_steps, NOTE_TIME_TOLERANCE, DIFFICULTY_TIERS, RHYTHM_GRID_VERSION
+from lyrics_engine import get_lyrics, get_timed_lyrics, save_lyrics
+from models import db, Song, FingerprintBand, AudioChunk, EditorDraft, EditorNote
+from migrate_db import upgrade_schema
+from database import configure_database, patch_eventlet_driver, read_only, reading_replica, pool_metrics
+from profiler import ProfileStore, start_profiler
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer, load_only
+from contextlib import contextmanager
 from functools import lru_cache
 from datetime import datetime
 
@@ -25,15 +46,270 @@ db_url = os.environ.get('DATABASE_URL') or SUPABASE_DB_URL
 if db_url.startswith("postgres://"):
     db_url = db_url.replace("postgres://", "postgresql://", 1)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+# Optional read replica for the read-only routes (menu, game, zen_game, audio)
+replica_url = os.environ.get('DATABASE_REPLICA_URL')
+if replica_url and replica_url.startswith("postgres://"):
+    replica_url = replica_url.replace("postgres://", "postgresql://", 1)
+
+configure_database(app, db_url, replica_url)
+patch_eventlet_driver()
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
+# Request profiling: admins opt in per request with ?profile=1, and
+# PROFILE_SAMPLE_RATE (0..1) profiles a random share of all requests.
+# PROFILING=0 removes the hooks entirely.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILING_ENABLED = os.environ.get('PROFILING', '1') != '0'
+profile_store = ProfileStore()
+
+
+def start_request_profile():
+    reason = None
+    if request.args.get('profile') == '1' and session.get('admin_authenticated'):
+        reason = 'admin'
+    elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        reason = 'sampled'
+    if reason:
+        g.profile = (start_profiler(), time.perf_counter(), reason)
+
+
+def record_profile_status(response):
+    if 'profile' in g:
+        g.profile_status = response.status_code
+    return response
+
+
+def finish_request_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    profiler, started, reason = profile
+    profiler.stop()
+    duration_ms = (time.perf_counter() - started) * 1000
+    status = g.pop('profile_status', 500)
+    try:
+        profile_store.save(profiler, request.method, request.full_path.rstrip('?'),
+                           request.endpoint, status, duration_ms, reason)
+    except OSError as e:
+        print(f"Could not save profile: {e}")
+
+
+if PROFILING_ENABLED:
+    app.before_request(start_request_profile)
+    app.after_request(record_profile_status)
+    app.teardown_request(finish_request_profile)
+
+
+def apply_analysis(song, analysis_data):
+    """Copies fresh audio analysis results onto a Song row."""
+    song.bpm = analysis_data['bpm']
+    song.beat_times = analysis_data['beat_times']
+    song.onset_times = analysis_data['onset_times']
+    song.onset_strengths = analysis_data.get('onset_strengths')
+    song.duration = analysis_data['duration']
+    song.rhythm_grid = analysis_data.get('rhythm_grid') or build_rhythm_grid(
+        analysis_data['beat_times'], analysis_data['onset_times'])
+    if analysis_data.get('fingerprint'):
+        index_fingerprint(song, analysis_data['fingerprint'])
+
+
+def stored_analysis(song):
+    """Rebuilds an analysis dict from the columns stored on a Song row."""
+    return {
+        'bpm': song.bpm,
+        'duration': song.duration,
+        'beat_times': song.beat_times,
+        'onset_times': song.onset_times,
+        'onset_strengths': song.onset_strengths,
+        'rhythm_grid': song.rhythm_grid
+    }
+
+
+def index_fingerprint(song, fingerprint):
+    """Stores a fingerprint and replaces the song's SimHash band rows."""
+    song.fingerprint = fingerprint
+    song.fingerprint_bands = [
+        FingerprintBand(band=band, key=key) for band, key in enumerate(band_keys(fingerprint))
+    ]
+
+
+# Index candidates confirmed against their audio per lookup (each costs one decode)
+MAX_CONFIRM_CANDIDATES = 3
+
+def find_duplicate_song(fingerprint, duration, onsets):
+    """
+    Looks up a near-duplicate of a fingerprint through the band index, so only
+    songs sharing at least one band are compared. Fingerprint matches are then
+    confirmed in time (tempo and onsets) against the candidate's stored
+    analysis, since reusing another song's audio cannot be undone.
+    onsets: the new track's onsets and tempo, from fingerprint_audio().
+    Returns the matching canonical Song or None.
+    """
+    if not fingerprint:
+        return None
+
+    keys = band_keys(fingerprint)
+    matches = or_(*[and_(FingerprintBand.band == band, FingerprintBand.key == key) for band, key in enumerate(keys)])
+    candidate_ids = [row.song_id for row in db.session.query(FingerprintBand.song_id).filter(matches).distinct()]
+    if not candidate_ids:
+        return None
+
+    candidates = Song.query.options(
+        load_only(Song.id, Song.title, Song.fingerprint, Song.duration, Song.bpm, Song.duplicate_of,
+                  Song.onset_times, Song.onset_strengths)
+    ).filter(Song.id.in_(candidate_ids)).all()
+
+    ranked = sorted(
+        (c for c in candidates
+         if not c.duplicate_of and is_near_duplicate(fingerprint, duration, c.fingerprint, c.duration)),
+        key=lambda c: similarity(fingerprint, c.fingerprint),
+        reverse=True
+    )
+    if not ranked:
+        return None
+
+    for candidate in ranked[:MAX_CONFIRM_CANDIDATES]:
+        stored = {
+            'bpm': candidate.bpm,
+            'onset_times': candidate.onset_times,
+            'onset_strengths': candidate.onset_strengths,
+            'duration': candidate.duration
+        }
+        if confirm_duplicate(onsets, stored):
+            return candidate
+        print(f"Fingerprint match with {candidate.id} not confirmed in time, treating as a new song")
+    return None
+
+
+# Uploads are written to and read from the database in pieces of this size
+AUDIO_CHUNK_SIZE = 1024 * 1024
+
+def store_audio_chunks(song_id, stream, chunk_size=AUDIO_CHUNK_SIZE):
+    """
+    Copies a file object into AudioChunk rows one chunk at a time. Each chunk
+    is flushed and dropped from the session, so memory does not grow with the
+    file. The Song row must already be flushed. Returns the number of chunks.
+    """
+    seq = 0
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            return seq
+        chunk = AudioChunk(song_id=song_id, seq=seq, data=data)
+        db.session.add(chunk)
+        db.session.flush()
+        db.session.expunge(chunk)
+        seq += 1
+
+
+def iter_audio_chunks(song_id):
+    """Yields a song's stored audio chunks in order, fetching one row at a time."""
+    rows = db.session.query(AudioChunk.data).filter_by(song_id=song_id).order_by(AudioChunk.seq).yield_per(1)
+    for (data,) in rows:
+        yield data
+
+
+def has_audio_chunks(song_id):
+    return db.session.query(AudioChunk.seq).filter_by(song_id=song_id).first() is not None
+
+
+@contextmanager
+def song_audio_path(song):
+    """Yields a file path with the song's audio (file on disk, DB blob or chunks), or None."""
+    if song.duplicate_of:
+        song = db.session.get(Song, song.duplicate_of) or song
+
+    if song.audio_path and os.path.exists(song.audio_path):
+        yield song.audio_path
+        return
+    if not song.audio_file and not has_audio_chunks(song.id):
+        yield None
+        return
+
+    # analyze_audio takes a file path, so spill the blob to a temp file
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
+        if song.audio_file:
+            tmp.write(song.audio_file)
+        else:
+            for data in iter_audio_chunks(song.id):
+                tmp.write(data)
+        tmp_path = tmp.name
+    try:
+        yield tmp_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def analyze_song_audio(song):
+    """Re-runs audio analysis on a song's stored audio."""
+    with song_audio_path(song) as path:
+        return analyze_audio(path) if path else None
+
+
+def apply_beat_map(song, beat_map, difficulty):
+    """
+    Stores a beatmap and its difficulty summary columns on a Song row.
+    Every write bumps beat_map_revision (the note index cache key). The version,
+    which scores and editor drafts are tied to, only changes with the notes.
+    """
+    if playable_content(song.beat_map) != playable_content(beat_map):
+        song.version = (song.version or 1) + 1
+    song.beat_map = beat_map
+    song.beat_map_revision = (song.beat_map_revision or 1) + 1
+    song.difficulty = difficulty
+    strain = get_beat_map_strain(beat_map) or {}
+    song.peak_strain = strain.get('peak')
+    song.avg_strain = strain.get('average')
+
+
+def expand_beat_map(beat_map, tier=None):
+    """Resolves a stored beatmap into the single-tier shape the client expects."""
+    beat_map = beat_map or {}
+    notes, tier, difficulty = get_tier_notes(beat_map, tier)
+    tiers = beat_map.get('tiers', {})
+    return {
+        'notes': notes,
+        'tier': tier,
+        'tiers': {name: entry['difficulty'] for name, entry in tiers.items()},
+        'difficulty': difficulty,
+        'case_sensitive': beat_map.get('case_sensitive', False),
+        'include_spaces': beat_map.get('include_spaces', False)
+    }
+
+
+# Time-sorted note index per beatmap revision and tier, so windows are a binary search
+@lru_cache(maxsize=64)
+def load_note_index(video_id, revision, tier):
+    song = Song.query.options(load_only(Song.id, Song.beat_map)).get_or_404(video_id)
+    return build_note_index(song.beat_map, tier)
+
+
+def resolve_tier(tier):
+    """A requested tier name, or None (the default tier) for anything unknown, so it is safe as a cache key."""
+    return tier if tier in DIFFICULTY_TIERS else None
+
+
+def note_window_payload(index, start, window=NOTE_WINDOW):
+    """Cuts the notes in [start, start + window) out of a note index."""
+    end = start + window
+    first_index, notes = note_window(index, start, end)
+    times = index['times']
+    return {
+        'notes': notes,
+        'first_index': first_index,
+        'window_start': start,
+        'window_end': end,
+        'has_more': bool(times) and times[-1] >= end
+    }
+
 
 @app.route('/')
+@read_only
 def menu():
     is_admin = False
     request_auth = False
@@ -45,8 +321,17 @@ def menu():
             request_auth = True
             
     # Optimize: Don't load audio_file for menu listing
-    songs = Song.query.options(defer(Song.audio_file), defer(Song.beat_times), defer(Song.onset_times), defer(Song.beat_map)).all()
-    songs_list = [song.to_dict() for song in songs]
+    query = Song.query.options(defer(Song.audio_file), defer(Song.beat_times), defer(Song.onset_times), defer(Song.onset_strengths), defer(Song.beat_map), defer(Song.rhythm_grid))
+
+    # Optional peak difficulty filter, e.g. /?min_peak=3&max_peak=6
+    min_peak = request.args.get('min_peak', type=float)
+    max_peak = request.args.get('max_peak', type=float)
+    if min_peak is not None:
+        query = query.filter(Song.peak_strain >= min_peak)
+    if max_peak is not None:
+        query = query.filter(Song.peak_strain <= max_peak)
+
+    songs_list = [song.to_dict(include_maps=False) for song in query.all()]
     return render_template('menu.html', songs=songs_list, is_admin=is_admin, request_auth=request_auth)
 
 @app.route('/login_admin', methods=['POST'])
@@ -60,11 +345,14 @@ def login_admin():
     return jsonify({'status': 'error', 'message': 'Invalid password'}), 401
 
 @app.route('/game/<video_id>')
+@read_only
 def game(video_id):
-    song = Song.query.options(defer(Song.audio_file), defer(Song.beat_times), defer(Song.onset_times)).get_or_404(video_id)
+    song = Song.query.options(defer(Song.audio_file), defer(Song.beat_times), defer(Song.onset_times), defer(Song.onset_strengths), defer(Song.beat_map)).get_or_404(video_id)
     
-    # Check if audio file exists in the database
-    if not song.audio_file:
+    # Check if audio file exists in the database (or on the song it duplicates). Uploads stored on
+    # disk by older builds only count when the file is on this instance.
+    has_local_file = bool(song.audio_path) and os.path.exists(song.audio_path)
+    if not song.duplicate_of and not has_local_file and not song.audio_file and not has_audio_chunks(song.id):
         print(f"Audio for {video_id} missing in DB. Downloading...")
         youtube_url = f"https://www.youtube.com/watch?v={video_id}"
         
@@ -85,24 +373,77 @@ def game(video_id):
     practice_mode = request.args.get('practice') == 'true'
     speed = float(request.args.get('speed', 1.0))
     start_time = float(request.args.get('start', 0.0))
+    tier = resolve_tier(request.args.get('tier'))
+
+    # Only the first window of notes (from the practice start) is shipped;
+    # game.js streams the rest from /beatmap_window as playback advances
+    index = load_note_index(song.id, song.beat_map_revision or 1, tier)
+    song_data = song.to_dict(include_maps=False)
+    song_data['beat_map'] = {
+        'tier': index['tier'],
+        'tiers': index['tiers'],
+        'difficulty': index['difficulty'],
+        'case_sensitive': index['case_sensitive'],
+        'include_spaces': index['include_spaces'],
+        'note_count': len(index['times']),
+        'last_note_time': index['times'][-1] if index['times'] else 0,
+        'window': NOTE_WINDOW,
+        **note_window_payload(index, max(start_time, 0.0))
+    }
+    song_data['difficulty'] = song_data['beat_map']['difficulty']
 
     # The template will now need an endpoint to serve the audio from the DB
     # or the audio_file itself (if small enough and handled by to_dict)
     # For large files, an endpoint is better.
     # Assuming song.to_dict() is updated to provide an audio_url pointing to /audio/<video_id>
-    return render_template('game.html', song_data=song.to_dict(), practice_mode=practice_mode, speed=speed, start_time=start_time)
+    return render_template('game.html', song_data=song_data, practice_mode=practice_mode, speed=speed, start_time=start_time)
+
+@app.route('/beatmap_window/<video_id>')
+@read_only
+def beatmap_window(video_id):
+    try:
+        start = float(request.args.get('t', 0.0))
+        window = float(request.args.get('window', NOTE_WINDOW))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid window'}), 400
+    if not (math.isfinite(start) and math.isfinite(window)):
+        return jsonify({'status': 'error', 'message': 'Invalid window'}), 400
+    window = min(max(window, 1.0), MAX_NOTE_WINDOW)
+
+    song = Song.query.options(load_only(Song.id, Song.beat_map_revision)).get_or_404(video_id)
+    index = load_note_index(song.id, song.beat_map_revision or 1, resolve_tier(request.args.get('tier')))
+    return jsonify({'status': 'success', 'tier': index['tier'], **note_window_payload(index, max(start, 0.0), window)})
 
 @app.route('/zen_game/<video_id>')
+@read_only
 def zen_game(video_id):
-    song = Song.query.options(defer(Song.beat_map), defer(Song.audio_file)).get_or_404(video_id)
-    
-    # Pass song data with beat/onset times - word generation happens in JS
-    song_data = song.to_dict()
-    
-    # Remove the pre-generated beatmap since we'll generate words dynamically in JS
-    if 'beat_map' in song_data:
-        del song_data['beat_map']
-    
+    song = Song.query.options(
+        defer(Song.beat_map),
+        defer(Song.audio_file),
+        defer(Song.beat_times),
+        defer(Song.onset_times),
+        defer(Song.onset_strengths)
+    ).get_or_404(video_id)
+
+    # Back-fill the rhythm grid for songs analyzed before it existed
+    grid = song.rhythm_grid
+    if not grid or grid.get('version') != RHYTHM_GRID_VERSION:
+        grid = build_rhythm_grid(song.beat_times, song.onset_times)
+        song.rhythm_grid = grid
+        db.session.commit()
+
+    # Only the precomputed grid is shipped - word generation happens in JS
+    song_data = {
+        'id': song.id,
+        'title': song.title,
+        'thumbnail': song.thumbnail_url,
+        'duration': song.duration,
+        'bpm': song.bpm,
+        'version': song.version or 1,
+        'rhythm_grid': grid['times'],
+        'first_beat': grid.get('first_beat')
+    }
+
     return render_template('zen_game.html', song_data=song_data)
 
 @app.route('/editor/<video_id>')
@@ -112,26 +453,77 @@ def editor(video_id):
     # Check for missing analysis data and regenerate if needed
     if not song.onset_times or not song.beat_times:
         print(f"Missing analysis data for {video_id} in editor, re-analyzing...")
-        # Need to reload the song WITH audio_file since it was deferred
-        song_with_audio = Song.query.get(video_id)
-        if song_with_audio and song_with_audio.audio_file:
-             with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
-                tmp.write(song_with_audio.audio_file)
-                tmp_path = tmp.name
-            
-             try:
-                analysis_data = analyze_audio(tmp_path)
-                if analysis_data:
-                    song.bpm = analysis_data['bpm']
-                    song.beat_times = analysis_data['beat_times']
-                    song.onset_times = analysis_data['onset_times']
-                    song.duration = analysis_data['duration']
-                    db.session.commit()
-             finally:
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
+        analysis_data = analyze_song_audio(song)
+        if analysis_data:
+            apply_analysis(song, analysis_data)
+            db.session.commit()
     
-    return render_template('editor.html', song_data=song.to_dict())
+    song_data = song.to_dict()
+    song_data['beat_map'] = expand_beat_map(song.beat_map)
+
+    # Resume an autosaved draft of this beatmap version, if there is one
+    draft = current_draft(song)
+    if draft:
+        song_data['note_times'] = [t for (t,) in db.session.query(EditorNote.time).filter_by(song_id=video_id).order_by(EditorNote.time)]
+    else:
+        song_data['note_times'] = editor_note_times(song.beat_map)
+    song_data['draft_revision'] = draft.revision if draft else 0
+    return render_template('editor.html', song_data=song_data)
+
+def editor_note_times(beat_map):
+    """
+    Note times the editor shows for a stored beatmap: the full timestamp list of
+    a map aligned to timed lyrics, else the default tier's notes.
+    """
+    beat_map = beat_map or {}
+    if 'timestamps' in beat_map:
+        return list(beat_map['timestamps'])
+    notes, _, _ = get_tier_notes(beat_map)
+    return sorted(set(float(n['time']) for n in notes))
+
+def current_draft(song):
+    """The song's editor draft, unless a newer beatmap was saved since it was started."""
+    draft = db.session.get(EditorDraft, song.id)
+    if draft and draft.base_version == (song.version or 1):
+        return draft
+    return None
+
+def start_draft(song):
+    """Copies the notes the editor shows into a new draft (once per editing session)."""
+    EditorNote.query.filter_by(song_id=song.id).delete(synchronize_session=False)
+    draft = db.session.get(EditorDraft, song.id) or EditorDraft(song_id=song.id)
+    draft.base_version = song.version or 1
+    draft.revision = 0
+    db.session.add(draft)
+    times = editor_note_times(song.beat_map)
+    if times:
+        db.session.execute(EditorNote.__table__.insert(), [{'song_id': song.id, 'time': t} for t in times])
+    db.session.flush()
+    return draft
+
+def discard_draft(video_id):
+    EditorNote.query.filter_by(song_id=video_id).delete(synchronize_session=False)
+    EditorDraft.query.filter_by(song_id=video_id).delete(synchronize_session=False)
+
+def editor_beat_map(song, notes, aligned_timestamps=None):
+    """
+    Builds the single-map beatmap stored for editor edits.
+    aligned_timestamps holds the editor's full timestamp list when notes
+    were aligned to timed lyrics (and so may be a subset of it).
+    Returns a tuple: (beat_map, difficulty)
+    """
+    strain = compute_strain(notes, song.duration, song.case_sensitive)
+    difficulty = calculate_difficulty(notes, song.duration, song.case_sensitive, strain)
+    beat_map = {
+        'notes': notes,
+        'difficulty': difficulty,
+        'strain': strain,
+        'case_sensitive': song.case_sensitive,
+        'include_spaces': song.include_spaces
+    }
+    if aligned_timestamps is not None:
+        beat_map['timestamps'] = aligned_timestamps
+    return beat_map, difficulty
 
 @app.route('/save_beatmap/<video_id>', methods=['POST'])
 def save_beatmap(video_id):
@@ -144,48 +536,112 @@ def save_beatmap(video_id):
     
     # Get lyrics
     lyrics = get_lyrics(video_id)
+    timed_lyrics = get_timed_lyrics(video_id)
     
     case_sensitive = song.case_sensitive
     include_spaces = song.include_spaces
     
-    # Map lyrics
-    notes = map_lyrics_to_beats(timestamps, lyrics, case_sensitive, include_spaces)
-    
-    # Calc diff
-    difficulty = calculate_difficulty(notes, song.duration, case_sensitive)
+    # Map lyrics (aligned to the sung timing when an .lrc file exists)
+    notes = map_lyrics_to_beats(timestamps, lyrics, case_sensitive, include_spaces, timed_lyrics=timed_lyrics)
     
-    # Update Song
-    song.beat_map = {
-        'notes': notes,
-        'difficulty': difficulty,
-        'case_sensitive': case_sensitive,
-        'include_spaces': include_spaces
-    }
-    song.difficulty = difficulty
-    song.version = (song.version or 1) + 1
+    # Calc diff and update Song; the full save supersedes any autosaved draft
+    beat_map, difficulty = editor_beat_map(song, notes, timestamps if timed_lyrics else None)
+    apply_beat_map(song, beat_map, difficulty)
+    discard_draft(video_id)
     
     db.session.commit()
     
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', 'version': song.version})
+
+@app.route('/patch_beatmap/<video_id>', methods=['POST'])
+def patch_beatmap(video_id):
+    """
+    Autosaves editor deltas into the song's draft. Each delta is an indexed
+    range lookup plus one row insert or delete, so a patch costs O(k log n)
+    and writes O(k) rows; the stored beatmap (characters, tiers, difficulty)
+    is only rebuilt by Save & Apply.
+    """
+    data = request.json or {}
+    try:
+        steps = note_patch_steps(data.get('ops', []))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'error': f'Invalid patch: {e}'}), 400
+
+    song = Song.query.options(load_only(Song.id, Song.version)).get_or_404(video_id)
+
+    # Optimistic concurrency: deltas only apply to the beatmap version and
+    # draft revision they were made against
+    current_version = song.version or 1
+    draft = current_draft(song)
+    revision = draft.revision if draft else 0
+    if data.get('version') != current_version or data.get('revision', 0) != revision:
+        return jsonify({'status': 'conflict', 'version': current_version, 'revision': revision}), 409
+
+    try:
+        if not draft:
+            start_draft(song)
+        # Conditional bump, so a concurrent patch between our read and write is detected
+        claimed = EditorDraft.query.filter_by(song_id=video_id, revision=revision).update(
+            {EditorDraft.revision: revision + 1}, synchronize_session=False)
+    except IntegrityError:
+        claimed = 0
+    if not claimed:
+        db.session.rollback()
+        return jsonify({'status': 'conflict', 'version': current_version}), 409
+
+    for kind, t in steps:
+        near = and_(EditorNote.song_id == video_id, EditorNote.time.between(t - NOTE_TIME_TOLERANCE, t + NOTE_TIME_TOLERANCE))
+        if kind == 'remove':
+            EditorNote.query.filter(near).delete(synchronize_session=False)
+        elif db.session.query(EditorNote.id).filter(near).first() is None:
+            db.session.add(EditorNote(song_id=video_id, time=t))
+    db.session.commit()
+
+    return jsonify({'status': 'success', 'version': current_version, 'revision': revision + 1})
 
-# Cache audio blobs in memory
+# Cache audio blobs in memory. Keyed by engine too, so a song that has not
+# reached the replica yet is not cached as missing for the primary retry.
 @lru_cache(maxsize=256)
-def load_audio_blob(video_id):
+def load_audio_blob(video_id, replica=False):
     song = Song.query.options(
         defer(Song.beat_map),
         defer(Song.onset_times),
+        defer(Song.onset_strengths),
         defer(Song.beat_times)
     ).get(video_id)
 
+    if song and song.duplicate_of:
+        return load_audio_blob(song.duplicate_of, replica)
     if song and song.audio_file:
         return song.audio_file
+    if song:
+        # Uploads are stored in chunks
+        return b''.join(iter_audio_chunks(song.id)) or None
+    return None
+
+
+# Cache on-disk audio locations (uploads) in memory
+@lru_cache(maxsize=1024)
+def load_audio_path(video_id, replica=False):
+    song = Song.query.options(load_only(Song.id, Song.audio_path, Song.duplicate_of)).get(video_id)
+    if song and song.duplicate_of:
+        return load_audio_path(song.duplicate_of, replica)
+    if song and song.audio_path:
+        return song.audio_path
     return None
 
 
 @app.route('/audio/<video_id>')
+@read_only
 def serve_audio(video_id):
 
-    data = load_audio_blob(video_id)
+    # Uploaded songs live on disk; send_file streams them and handles Range
+    audio_path = load_audio_path(video_id, reading_replica())
+    if audio_path and os.path.exists(audio_path):
+        mimetype = mimetypes.guess_type(audio_path)[0] or "audio/mpeg"
+        return send_file(audio_path, mimetype=mimetype, conditional=True)
+
+    data = load_audio_blob(video_id, reading_replica())
 
     if data is None:
         return "Audio not found", 404
@@ -205,7 +661,7 @@ def serve_audio(video_id):
         rv = Response(
             chunk,
             status=206,
-            mimetype="audio/mpeg",
+            mimetype=audio_mimetype(data),
             direct_passthrough=True
         )
 
@@ -218,7 +674,7 @@ def serve_audio(video_id):
     rv = Response(
         data,
         status=200,
-        mimetype="audio/mpeg",
+        mimetype=audio_mimetype(data),
         direct_passthrough=True
     )
     rv.headers.add("Accept-Ranges", "bytes")
@@ -228,11 +684,121 @@ def serve_audio(video_id):
 
 @app.route('/delete_song/<video_id>', methods=['DELETE'])
 def delete_song(video_id):
-    song = Song.query.get_or_404(video_id)
+    song = Song.query.options(defer(Song.audio_file)).get_or_404(video_id)
+    audio_path = song.audio_path
+
+    # Songs reusing this one's audio would be left without any: promote one of them
+    aliases = Song.query.options(defer(Song.audio_file)).filter_by(duplicate_of=video_id).all()
+    if aliases:
+        heir = aliases[0]
+        heir.duplicate_of = None
+        heir.audio_file = song.audio_file
+        heir.audio_path = song.audio_path
+        heir.content_hash = song.content_hash
+        AudioChunk.query.filter_by(song_id=video_id).update({AudioChunk.song_id: heir.id}, synchronize_session=False)
+        if song.fingerprint:
+            index_fingerprint(heir, song.fingerprint)
+        for alias in aliases[1:]:
+            alias.duplicate_of = heir.id
+        audio_path = None
+        load_audio_blob.cache_clear()
+        load_audio_path.cache_clear()
+    else:
+        AudioChunk.query.filter_by(song_id=video_id).delete(synchronize_session=False)
+    discard_draft(video_id)
+
     db.session.delete(song)
     db.session.commit()
+    # A song re-added under this id starts again at version 1
+    load_note_index.cache_clear()
+
+    # Uploaded audio is content-addressed, so only remove it when unreferenced
+    if audio_path and not Song.query.filter_by(audio_path=audio_path).first() and os.path.exists(audio_path):
+        os.remove(audio_path)
     return jsonify({'status': 'success'})
 
+@app.route('/admin/duplicates')
+def duplicate_report():
+    if not session.get('admin_authenticated'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+
+    # Songs sharing a SimHash band are the only pairs worth comparing
+    buckets = {}
+    for row in db.session.query(FingerprintBand.song_id, FingerprintBand.band, FingerprintBand.key):
+        buckets.setdefault((row.band, row.key), []).append(row.song_id)
+
+    songs = {
+        song.id: song for song in Song.query.options(
+            load_only(Song.id, Song.title, Song.duration, Song.fingerprint, Song.duplicate_of)
+        ).all()
+    }
+
+    # Union-find over verified near-duplicate pairs and known aliases
+    parent = {}
+    def find(song_id):
+        parent.setdefault(song_id, song_id)
+        while parent[song_id] != song_id:
+            parent[song_id] = parent[parent[song_id]]
+            song_id = parent[song_id]
+        return song_id
+
+    checked = set()
+    for members in buckets.values():
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (a, b) if a < b else (b, a)
+                if pair in checked or a not in songs or b not in songs:
+                    continue
+                checked.add(pair)
+                song_a, song_b = songs[a], songs[b]
+                if is_near_duplicate(song_a.fingerprint, song_a.duration, song_b.fingerprint, song_b.duration):
+                    parent[find(a)] = find(b)
+
+    for song in songs.values():
+        if song.duplicate_of in songs:
+            parent[find(song.id)] = find(song.duplicate_of)
+
+    clusters = {}
+    for song_id in list(parent):
+        clusters.setdefault(find(song_id), []).append(song_id)
+
+    report = []
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        report.append([
+            {
+                'id': song_id,
+                'title': songs[song_id].title,
+                'duration': songs[song_id].duration,
+                'duplicate_of': songs[song_id].duplicate_of
+            } for song_id in sorted(members)
+        ])
+
+    return jsonify({'status': 'success', 'clusters': report})
+
+@app.route('/admin/db_metrics')
+def db_metrics():
+    if not session.get('admin_authenticated'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    return jsonify({'status': 'success', 'pools': pool_metrics(db)})
+
+@app.route('/admin/profiles')
+def profile_report():
+    if not session.get('admin_authenticated'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    return render_template('profiles.html', profiles=profile_store.slowest(),
+                           sample_rate=PROFILE_SAMPLE_RATE, enabled=PROFILING_ENABLED)
+
+@app.route('/admin/profiles/<name>')
+def download_profile(name):
+    if not session.get('admin_authenticated'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    path = profile_store.path_for(name)
+    if not path or not os.path.exists(path):
+        return jsonify({'status': 'error', 'message': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), mimetype='text/plain', as_attachment=True, download_name=name)
+
 @app.route('/regenerate_beatmap/<video_id>', methods=['POST'])
 def regenerate_beatmap(video_id):
     song = Song.query.options(defer(Song.beat_map)).get_or_404(video_id)
@@ -252,56 +818,29 @@ def regenerate_beatmap(video_id):
     # Check if analysis data is complete; if not, re-analyze
     if not song.onset_times or not song.beat_times:
         print(f"Missing analysis data for {video_id}, re-analyzing...")
-        # Need to fetch audio data to re-analyze. 
-        # Since we serve form DB, we might need a temp file or update AudioEngine to accept bytes.
-        # But wait, AudioEngine.analyze_audio takes a file path.
-        # Let's write the binary to a temp file.
-        import tempfile
-        import os
-        import audio_engine
+        analysis_data = analyze_song_audio(song)
+        if analysis_data:
+            # Update Song object with new data
+            apply_analysis(song, analysis_data)
 
-        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
-            tmp.write(song.audio_file)
-            tmp_path = tmp.name
-        
-        try:
-             # Re-run analysis
-            analysis_data = audio_engine.analyze_audio(tmp_path)
-            
-            if analysis_data:
-                # Update Song object with new data
-                song.bpm = analysis_data['bpm']
-                song.beat_times = analysis_data['beat_times']
-                song.onset_times = analysis_data['onset_times']
-                song.duration = analysis_data['duration']
-            
-                # Commit these updates so next time it's fast
-                db.session.commit()
-            
-        finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            # Commit these updates so next time it's fast
+            db.session.commit()
 
-    analysis = {
-        'bpm': song.bpm,
-        'duration': song.duration,
-        'beat_times': song.beat_times,
-        'onset_times': song.onset_times
-    }
+    analysis = stored_analysis(song)
 
     # Get lyrics (cached or fresh or custom)
+    timed_lyrics = None
     if custom_lyrics and custom_lyrics.strip():
         lyrics = custom_lyrics.strip()
     else:
         lyrics = get_lyrics(video_id)
+        timed_lyrics = get_timed_lyrics(video_id)
     
     # Generate Map
-    beat_map, difficulty = generate_beat_map(analysis, lyrics, monotone_factor, case_sensitive, include_spaces)
+    beat_map, difficulty = generate_beat_map(analysis, lyrics, monotone_factor, case_sensitive, include_spaces, timed_lyrics=timed_lyrics)
     
     # Update DB
-    song.beat_map = beat_map
-    song.difficulty = difficulty
-    song.version = (song.version or 1) + 1  # Increment version
+    apply_beat_map(song, beat_map, difficulty)
     song.date_added = datetime.now()
     db.session.commit()
     
@@ -337,33 +876,55 @@ def process_song():
     # Try to use existing analysis if available
     if existing_song:
         if existing_song.beat_times and existing_song.onset_times:
-             analysis = {
-                 'bpm': existing_song.bpm,
-                 'duration': existing_song.duration,
-                 'beat_times': existing_song.beat_times,
-                 'onset_times': existing_song.onset_times
-             }
+             analysis = stored_analysis(existing_song)
              # Update title if better
              if title and title != "Unknown Title":
                  existing_song.title = title
     
+    duplicate = None
     if not analysis:
-        # No valid cached analysis, run fresh
-        analysis = analyze_audio(file_path)
-        if not analysis:
+        audio = load_audio(file_path)
+        if not audio:
             return jsonify({'error': 'Analysis failed'}), 500
+
+        # Same track already uploaded under another video id? Reuse its analysis
+        if not existing_song:
+            fingerprint, duration, onsets = fingerprint_audio(audio)
+            duplicate = find_duplicate_song(fingerprint, duration, onsets)
+
+        if duplicate:
+            print(f"{video_id} matches {duplicate.id}, reusing its audio and analysis")
+            analysis = stored_analysis(duplicate)
+        else:
+            # No valid cached analysis, run fresh
+            analysis = analyze_audio(file_path, audio=audio)
+            if not analysis:
+                return jsonify({'error': 'Analysis failed'}), 500
         
     # 3. Get Lyrics
+    timed_lyrics = None
     if custom_lyrics and custom_lyrics.strip():
         lyrics = custom_lyrics.strip()
     else:
         lyrics = get_lyrics(video_id)
+        timed_lyrics = get_timed_lyrics(video_id)
     
     # 4. Generate Map
-    beat_map, difficulty = generate_beat_map(analysis, lyrics, monotone_factor, case_sensitive, include_spaces)
+    beat_map, difficulty = generate_beat_map(analysis, lyrics, monotone_factor, case_sensitive, include_spaces, timed_lyrics=timed_lyrics)
     
     # Prepare data for DB
-    if not existing_song:
+    if duplicate:
+        # Audio is served from the matching song, so no second blob is stored
+        try:
+            os.remove(file_path)
+        except:
+            pass
+
+        existing_song = Song(id=video_id, duplicate_of=duplicate.id)
+        db.session.add(existing_song)
+    elif not existing_song:
+        content_hash = hash_file(file_path)
+
         # Read audio bytes
         with open(file_path, "rb") as f:
             audio_bytes = f.read()
@@ -379,16 +940,13 @@ def process_song():
         if not existing_song:
             existing_song = Song(id=video_id)
             existing_song.audio_file = audio_bytes
+            existing_song.content_hash = content_hash
             db.session.add(existing_song)
     
     existing_song.title = title if title else (existing_song.title if existing_song.title else f"Song {video_id}")
     existing_song.thumbnail_url = f"https://img.youtube.com/vi/{video_id}/0.jpg"
-    existing_song.duration = analysis['duration']
-    existing_song.bpm = analysis['bpm']
-    existing_song.difficulty = difficulty
-    existing_song.beat_times = analysis['beat_times']
-    existing_song.onset_times = analysis['onset_times']
-    existing_song.beat_map = beat_map
+    apply_analysis(existing_song, analysis)
+    apply_beat_map(existing_song, beat_map, difficulty)
     existing_song.case_sensitive = case_sensitive
     existing_song.include_spaces = include_spaces
     
@@ -399,6 +957,95 @@ def process_song():
         'video_id': video_id
     })
 
+@app.route('/upload_song', methods=['POST'])
+def upload_song():
+    # Parse the multipart body ourselves so the file is hashed and written once,
+    # straight into a temp file, instead of spooled by werkzeug and copied again
+    sinks = []
+    try:
+        _, form, files = parse_form_data(request.environ, stream_factory=upload_stream_factory(sinks))
+        return ingest_upload(form, files)
+    finally:
+        for sink in sinks:
+            sink.discard()
+
+
+def ingest_upload(form, files):
+    """Analyzes an uploaded audio file and stores it, with its audio, as a new song."""
+    upload = files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file provided'}), 400
+
+    sink = upload.stream
+    ext = os.path.splitext(upload.filename)[1].lower()
+    if ext not in UPLOAD_EXTENSIONS or sink.size == 0:
+        return jsonify({'error': 'Unsupported or empty audio file'}), 400
+    sink.flush()
+    file_path = sink.path
+    content_hash = sink.hexdigest()
+
+    custom_lyrics = form.get('custom_lyrics')
+    monotone_factor_input = float(form.get('monotone_factor', 0.5))
+    monotone_min = 0.1
+    monotone_max = 0.8
+    monotone_factor = monotone_min + (monotone_max - monotone_min) * monotone_factor_input
+
+    case_sensitive = form.get('case_sensitive', 'false').lower() == 'true'
+    include_spaces = form.get('include_spaces', 'false').lower() == 'true'
+
+    # 1. Same audio already in the catalogue? Skip analysis entirely
+    duplicate = Song.query.options(load_only(Song.id)).filter_by(content_hash=content_hash).first()
+    if duplicate:
+        return jsonify({'status': 'duplicate', 'video_id': duplicate.id})
+
+    video_id = f"upload_{content_hash[:16]}"
+    title = form.get('title') or os.path.splitext(os.path.basename(upload.filename))[0]
+
+    # 2. Near-duplicate of a song in the catalogue (different encode)?
+    audio = load_audio(file_path)
+    if not audio:
+        return jsonify({'error': 'Analysis failed'}), 500
+
+    fingerprint, duration, onsets = fingerprint_audio(audio)
+    duplicate = find_duplicate_song(fingerprint, duration, onsets)
+    if duplicate:
+        return jsonify({'status': 'duplicate', 'video_id': duplicate.id})
+
+    # 3. Analyze
+    analysis = analyze_audio(file_path, audio=audio)
+    if not analysis:
+        return jsonify({'error': 'Analysis failed'}), 500
+
+    # 4. Get Lyrics
+    timed_lyrics = None
+    if custom_lyrics and custom_lyrics.strip():
+        lyrics = custom_lyrics.strip()
+    else:
+        lyrics = get_lyrics(video_id)
+        timed_lyrics = get_timed_lyrics(video_id)
+
+    # 5. Generate Map
+    beat_map, difficulty = generate_beat_map(analysis, lyrics, monotone_factor, case_sensitive, include_spaces, timed_lyrics=timed_lyrics)
+
+    # The audio goes into the shared database like downloaded songs, since
+    # local disk is neither shared between instances nor kept across deploys.
+    # It is copied from the temp file in chunks, never read whole.
+    song = Song(id=video_id, title=title, content_hash=content_hash)
+    apply_analysis(song, analysis)
+    apply_beat_map(song, beat_map, difficulty)
+    song.case_sensitive = case_sensitive
+    song.include_spaces = include_spaces
+    db.session.add(song)
+    db.session.flush()
+    sink.seek(0)
+    store_audio_chunks(video_id, sink)
+    db.session.commit()
+
+    return jsonify({
+        'status': 'success',
+        'video_id': video_id
+    })
+
 @app.route('/favicon.ico')
 def favicon():
     return '', 204
@@ -409,6 +1056,7 @@ if __name__ == '__main__':
         # Ensure context for DB creation if needed roughly, though better to use migrate script
         with app.app_context():
             db.create_all()
+            upgrade_schema(db.engine)
             
         import os
         port = int(os.environ.get('PORT', 8000))
@@ -1,16 +1,84 @@
 import os
+import hashlib
+import tempfile
 import yt_dlp
 import librosa
 import numpy as np
 from pydub import AudioSegment
+from game_engine import build_rhythm_grid
+from fingerprint_engine import compute_fingerprint
 
 # Configuration
 STATIC_SONGS_FOLDER = 'static/songs'
+ANALYSIS_SAMPLE_RATE = 22050
+UPLOAD_EXTENSIONS = {'.mp3', '.wav', '.ogg', '.m4a', '.flac'}
+CHUNK_SIZE = 1024 * 1024
 
 def ensure_dirs():
     if not os.path.exists(STATIC_SONGS_FOLDER):
         os.makedirs(STATIC_SONGS_FOLDER)
 
+def hash_file(file_path):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class UploadSink:
+    """
+    Receives an uploaded file part straight from the multipart parser (see
+    upload_stream_factory): bytes go to one private temp file and into a
+    SHA-256 digest as they arrive, so the upload is written exactly once and
+    never held in memory. Everything else is delegated to the temp file.
+    """
+    def __init__(self, suffix=''):
+        fd, self.path = tempfile.mkstemp(suffix=suffix)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def audio_mimetype(data):
+    """Guesses the MIME type of stored audio bytes from their header, defaulting to MP3."""
+    head = bytes(data[:12])
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    if head.startswith(b'fLaC'):
+        return 'audio/flac'
+    if head.startswith(b'OggS'):
+        return 'audio/ogg'
+    if head[4:8] == b'ftyp':
+        return 'audio/mp4'
+    return 'audio/mpeg'
+
+def upload_stream_factory(sinks):
+    """
+    Returns a werkzeug stream_factory that parses every file part into an
+    UploadSink and appends it to sinks, so the caller can clean them up.
+    """
+    def factory(total_content_length, content_type, filename, content_length=None):
+        sink = UploadSink(os.path.splitext(filename or '')[1].lower())
+        sinks.append(sink)
+        return sink
+    return factory
+
 def download_audio(youtube_url):
     """
     Downloads audio from a YouTube URL and converts it to MP3.
@@ -72,13 +140,53 @@ def download_audio(youtube_url):
         print(f"Error downloading {youtube_url}: {e}")
         return None, None, None
 
-def analyze_audio(file_path):
+def load_audio(file_path):
+    """
+    Decodes an audio file at the analysis sample rate.
+    Returns (y, sr) or None if decoding fails.
+    """
+    try:
+        return librosa.load(file_path, sr=ANALYSIS_SAMPLE_RATE)
+    except Exception as e:
+        print(f"Error loading audio: {e}")
+        return None
+
+def fingerprint_audio(audio):
+    """
+    Computes only the fingerprint of decoded audio (see load_audio), which is
+    much cheaper than a full analyze_audio run. The onsets and tempo estimated
+    on the way are returned too, in the shape confirm_duplicate compares
+    against a stored song (same estimators as analyze_audio).
+    Returns (fingerprint, duration, onsets) or (None, None, None).
+    """
+    try:
+        y, sr = audio
+        onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+        onset_frames = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr)
+        onset_times = librosa.frames_to_time(onset_frames, sr=sr)
+        duration = librosa.get_duration(y=y, sr=sr)
+        onsets = {
+            'bpm': float(np.atleast_1d(librosa.feature.tempo(onset_envelope=onset_env, sr=sr))[0]),
+            'onset_times': onset_times.tolist(),
+            'onset_strengths': onset_env[onset_frames].tolist(),
+            'duration': duration
+        }
+        return compute_fingerprint(y, sr, onset_times), duration, onsets
+    except Exception as e:
+        print(f"Error fingerprinting audio: {e}")
+        return None, None, None
+
+def analyze_audio(file_path, audio=None):
     """
     Analyzes the audio file to detect BPM and beat onsets.
+    audio: optional (y, sr) from load_audio() to avoid decoding the file twice.
     Returns a dictionary with analysis data.
     """
     try:
-        y, sr = librosa.load(file_path, sr=22050)
+        if audio is not None:
+            y, sr = audio
+        else:
+            y, sr = librosa.load(file_path, sr=ANALYSIS_SAMPLE_RATE)
         
         tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
         beat_times = librosa.frames_to_time(beat_frames, sr=sr)
@@ -88,9 +196,13 @@ def analyze_audio(file_path):
         onset_times = librosa.frames_to_time(onset_frames, sr=sr)
 
         return {
-            'bpm': float(tempo),
+            # beat_track returns a 1-element array in librosa >= 0.10
+            'bpm': float(np.atleast_1d(tempo)[0]),
             'beat_times': beat_times.tolist(),
             'onset_times': onset_times.tolist(),
+            'onset_strengths': onset_env[onset_frames].tolist(),
+            'rhythm_grid': build_rhythm_grid(beat_times, onset_times),
+            'fingerprint': compute_fingerprint(y, sr, onset_times),
             'duration': librosa.get_duration(y=y, sr=sr)
         }
     except Exception as e:
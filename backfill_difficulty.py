@@ -0,0 +1,66 @@
+import sys
+import copy
+from sqlalchemy.orm import defer, load_only
+from app import app, apply_beat_map
+from models import db, Song
+from game_engine import get_tier_notes, compute_strain, calculate_difficulty
+
+def rescore_beat_map(beat_map, duration):
+    """
+    Recomputes strain and star rating for every tier of a stored beatmap.
+    Returns a new beatmap dict and the difficulty of its default tier.
+    """
+    beat_map = copy.deepcopy(beat_map)
+    case_sensitive = beat_map.get('case_sensitive', False)
+
+    if 'tiers' not in beat_map:
+        notes = beat_map.get('notes', [])
+        strain = compute_strain(notes, duration, case_sensitive)
+        beat_map['strain'] = strain
+        beat_map['difficulty'] = calculate_difficulty(notes, duration, case_sensitive, strain)
+        return beat_map, beat_map['difficulty']
+
+    for name, entry in beat_map['tiers'].items():
+        notes, _, _ = get_tier_notes(beat_map, name)
+        strain = compute_strain(notes, duration, case_sensitive)
+        entry['strain'] = strain
+        entry['difficulty'] = calculate_difficulty(notes, duration, case_sensitive, strain)
+
+    default = beat_map['tiers'].get(beat_map.get('default_tier'))
+    beat_map['difficulty'] = default['difficulty'] if default else 1
+    return beat_map, beat_map['difficulty']
+
+def backfill(batch_size=50):
+    with app.app_context():
+        ids = [row.id for row in Song.query.options(load_only(Song.id)).order_by(Song.id).all()]
+        print(f"Rescoring {len(ids)} songs...")
+
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            batch = Song.query.options(
+                defer(Song.audio_file),
+                defer(Song.beat_times),
+                defer(Song.onset_times),
+                defer(Song.onset_strengths),
+                defer(Song.rhythm_grid)
+            ).filter(Song.id.in_(ids[start:start + batch_size])).all()
+
+            for song in batch:
+                if not song.beat_map:
+                    continue
+                beat_map, difficulty = rescore_beat_map(song.beat_map, song.duration)
+                apply_beat_map(song, beat_map, difficulty)
+                updated += 1
+
+            db.session.commit()
+            # Drop the batch from the identity map to keep memory flat
+            db.session.expunge_all()
+            print(f"{min(start + batch_size, len(ids))}/{len(ids)} done")
+
+        print(f"Successfully rescored {updated} songs.")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        backfill(int(sys.argv[1]))
+    else:
+        backfill()
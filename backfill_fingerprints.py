@@ -0,0 +1,59 @@
+import sys
+from sqlalchemy.orm import load_only
+from app import app, song_audio_path, index_fingerprint
+from models import db, Song
+from audio_engine import load_audio, fingerprint_audio
+
+def backfill(limit=None):
+    with app.app_context():
+        query = Song.query.options(load_only(Song.id)).filter(
+            Song.fingerprint.is_(None), Song.duplicate_of.is_(None)
+        ).order_by(Song.id)
+        ids = [row.id for row in (query.limit(limit) if limit else query).all()]
+        print(f"Fingerprinting {len(ids)} songs...")
+
+        done = 0
+        for video_id in ids:
+            song = db.session.get(Song, video_id)
+            with song_audio_path(song) as path:
+                audio = load_audio(path) if path else None
+            if not audio:
+                print(f"Skipping {video_id}: no audio")
+                continue
+
+            fingerprint, _, _ = fingerprint_audio(audio)
+            if fingerprint:
+                index_fingerprint(song, fingerprint)
+                db.session.commit()
+                done += 1
+            # One song's audio at a time keeps memory flat
+            db.session.expunge_all()
+            print(f"{done}/{len(ids)} {video_id}")
+
+        print(f"Successfully fingerprinted {done} songs.")
+
+def reindex(batch_size=200):
+    """Rebuilds the band index from stored fingerprints, e.g. after the band layout changed."""
+    with app.app_context():
+        ids = [row.id for row in Song.query.options(load_only(Song.id)).filter(
+            Song.fingerprint.isnot(None)
+        ).order_by(Song.id).all()]
+        print(f"Reindexing {len(ids)} songs...")
+
+        for start in range(0, len(ids), batch_size):
+            batch = Song.query.options(load_only(Song.id, Song.fingerprint)).filter(
+                Song.id.in_(ids[start:start + batch_size])
+            ).all()
+            for song in batch:
+                index_fingerprint(song, song.fingerprint)
+            db.session.commit()
+            db.session.expunge_all()
+            print(f"{min(start + batch_size, len(ids))}/{len(ids)} done")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--reindex':
+        reindex()
+    elif len(sys.argv) > 1:
+        backfill(int(sys.argv[1]))
+    else:
+        backfill()
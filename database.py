@@ -0,0 +1,152 @@
+import os
+import time
+from collections import deque
+from functools import wraps
+from flask import current_app, g, has_app_context, make_response
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import NotFound
+
+REPLICA_BIND = 'replica'
+
+# Pool sizing, per process and per engine (primary and replica each get one pool)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+WAIT_SAMPLES = 1000
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=WAIT_SAMPLES)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.recent_waits.append(wait)
+
+    def metrics(self):
+        waits = sorted(self.recent_waits)
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 3) if waits else 0.0
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': self.overflow(),
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_ms_avg': round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            'wait_ms_p50': percentile(0.50),
+            'wait_ms_p95': percentile(0.95),
+            'wait_ms_p99': percentile(0.99),
+            'wait_ms_max': round(self.max_wait * 1000, 3)
+        }
+
+def engine_options(url):
+    """Pool settings for an engine URL. SQLite in-memory databases keep their default pool."""
+    options = {'pool_pre_ping': DB_POOL_PRE_PING}
+    if url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') in ('sqlite:', 'sqlite')):
+        return options
+    options.update({
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE
+    })
+    return options
+
+def configure_database(app, primary_url, replica_url=None):
+    """Sets the engine URIs and pool options on the app config. Call before db.init_app."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = primary_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(primary_url)
+    if replica_url:
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: {'url': replica_url, **engine_options(replica_url)}}
+
+def patch_eventlet_driver():
+    """
+    Makes psycopg2 yield to the eventlet hub while waiting on the network, so a
+    slow query only blocks its own greenthread. No-op without eventlet monkey
+    patching or psycogreen.
+    """
+    try:
+        from eventlet.patcher import is_monkey_patched
+    except ImportError:
+        return False
+    if not is_monkey_patched('socket'):
+        return False
+    try:
+        from psycogreen.eventlet import patch_psycopg
+    except ImportError:
+        print("psycogreen not installed: psycopg2 queries will block the eventlet hub")
+        return False
+    patch_psycopg()
+    return True
+
+class RoutingSession(Session):
+    """
+    Sends queries made inside a read_only view to the replica engine when one is
+    configured. Flushes always go to the primary, so a read-only view that still
+    writes (e.g. a lazy back-fill) stays correct.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and reading_replica():
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def reading_replica():
+    return has_app_context() and g.get('db_read_only', False)
+
+def read_only(view):
+    """
+    Marks a view as read-only so its queries go to the replica.
+    A 404 from the replica is retried once on the primary, since a song that
+    was just ingested may not have replicated yet.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        db = current_app.extensions['sqlalchemy']
+        if REPLICA_BIND not in db.engines:
+            return view(*args, **kwargs)
+
+        g.db_read_only = True
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 404:
+                return response
+        except NotFound:
+            pass
+        finally:
+            g.db_read_only = False
+
+        db.session.rollback()
+        return view(*args, **kwargs)
+    return wrapper
+
+def pool_metrics(db):
+    """Checkout wait and occupancy for every engine that uses a TimedQueuePool."""
+    metrics = {}
+    for key, engine in db.engines.items():
+        if isinstance(engine.pool, TimedQueuePool):
+            metrics[key or 'primary'] = {'url': engine.url.render_as_string(hide_password=True), **engine.pool.metrics()}
+    return metrics
@@ -0,0 +1,117 @@
+import numpy as np
+import librosa
+from scipy import signal
+
+# Fingerprint layout: mean chroma (12) + chroma spread (12) + inter-onset histogram (8)
+IOI_BINS = np.array([0.0, 0.1, 0.15, 0.2, 0.3, 0.4, 0.6, 1.0, np.inf])
+
+# SimHash index: 128 random hyperplanes split into 8 bands of 16 bits.
+# Two songs become candidates when any band matches exactly; 16-bit bands keep
+# each bucket to a tiny share of the catalogue, so lookups stay sub-linear.
+HASH_BITS = 128
+BAND_BITS = 16
+HASH_SEED = 1337
+_HYPERPLANES = np.random.default_rng(HASH_SEED).standard_normal((HASH_BITS, 12 + 12 + len(IOI_BINS) - 1))
+
+# Verification thresholds for a candidate pair
+MIN_SIMILARITY = 0.97
+MAX_DURATION_DIFF = 0.05  # relative
+
+# Time-aligned confirmation, required before one song's audio is reused for another.
+# The summary vector above has no notion of time, so unrelated tracks with a
+# similar key profile can pass it. The check compares onsets and tempo, which
+# every song already stores from its analysis, so no audio is decoded for it.
+ONSET_RESOLUTION = 0.02      # seconds per bin of the compared onset trains
+MAX_ALIGN_LAG = 10.0         # seconds of offset tolerated between the two tracks
+MIN_ONSET_CORRELATION = 0.65   # different tracks at one tempo score ~0.5, re-encodes 0.7+
+MAX_BPM_DIFF = 0.05          # relative; adjacent bins of the tempo estimator are ~4% apart
+
+def _normalize_block(values):
+    values = np.asarray(values, dtype=float)
+    values = values - values.mean()
+    norm = np.linalg.norm(values)
+    return values / norm if norm > 0 else values
+
+def compute_fingerprint(y, sr, onset_times):
+    """
+    Builds a compact, offset-invariant fingerprint of a track from its chroma
+    profile and onset rhythm. Each block is centred and L2-normalised so cosine
+    similarity and SimHash behave.
+    Returns a list of floats.
+    """
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr)
+    intervals = np.diff(np.asarray(onset_times, dtype=float))
+    ioi_hist = np.histogram(intervals, bins=IOI_BINS)[0] if intervals.size else np.zeros(len(IOI_BINS) - 1)
+
+    vector = np.concatenate([
+        _normalize_block(chroma.mean(axis=1)),
+        _normalize_block(chroma.std(axis=1)),
+        _normalize_block(ioi_hist)
+    ])
+    return np.round(vector, 4).tolist()
+
+def band_keys(fingerprint):
+    """Returns the SimHash band values of a fingerprint as a list of ints."""
+    bits = (_HYPERPLANES @ np.asarray(fingerprint, dtype=float)) > 0
+    bands = bits.reshape(-1, BAND_BITS)
+    weights = 1 << np.arange(BAND_BITS)
+    return (bands * weights).sum(axis=1).astype(int).tolist()
+
+def similarity(a, b):
+    """Cosine similarity of two fingerprints."""
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / denom) if denom > 0 else 0.0
+
+def is_near_duplicate(fp_a, duration_a, fp_b, duration_b):
+    """Verifies an index candidate: similar fingerprint and nearly equal length."""
+    if not fp_a or not fp_b or len(fp_a) != len(fp_b):
+        return False
+    if duration_a and duration_b:
+        if abs(duration_a - duration_b) > MAX_DURATION_DIFF * max(duration_a, duration_b):
+            return False
+    return similarity(fp_a, fp_b) >= MIN_SIMILARITY
+
+def onset_train(onset_times, onset_strengths, duration):
+    """
+    Onsets as a strength-weighted pulse train on a ONSET_RESOLUTION grid,
+    smoothed so onsets one analysis frame apart still overlap.
+    Songs analyzed before onset strengths were stored weigh every onset equally.
+    """
+    times = np.asarray(onset_times or [], dtype=float)
+    weights = np.asarray(onset_strengths, dtype=float) if onset_strengths and len(onset_strengths) == times.size else np.ones(times.size)
+    bins = int(max(duration or 0.0, times.max() if times.size else 0.0) / ONSET_RESOLUTION) + 1
+    train = np.zeros(bins)
+    np.add.at(train, np.clip((times / ONSET_RESOLUTION).astype(int), 0, bins - 1), weights)
+    return np.convolve(train, [0.0625, 0.25, 0.375, 0.25, 0.0625], mode='same')
+
+def aligned_onset_correlation(train_a, train_b):
+    """Best normalized cross-correlation of two onset trains over offsets up to MAX_ALIGN_LAG."""
+    a = train_a - train_a.mean()
+    b = train_b - train_b.mean()
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    if denom == 0:
+        return 0.0
+    scores = signal.correlate(a, b, mode='full', method='fft')
+    max_lag = int(MAX_ALIGN_LAG / ONSET_RESOLUTION)
+    zero = b.size - 1
+    window = scores[max(0, zero - max_lag):zero + max_lag + 1]
+    return float(window.max() / denom)
+
+def confirm_duplicate(onsets_a, onsets_b):
+    """
+    Confirms an index match: same tempo, and onsets line up in time.
+    onsets_*: dicts with 'bpm', 'onset_times', 'onset_strengths' and 'duration',
+    as stored on a Song by analyze_audio (or returned by fingerprint_audio).
+    """
+    bpm_a, bpm_b = onsets_a.get('bpm'), onsets_b.get('bpm')
+    if bpm_a and bpm_b and abs(bpm_a - bpm_b) > MAX_BPM_DIFF * max(bpm_a, bpm_b):
+        return False
+    if not onsets_a.get('onset_times') or not onsets_b.get('onset_times'):
+        return False
+    score = aligned_onset_correlation(
+        onset_train(onsets_a['onset_times'], onsets_a.get('onset_strengths'), onsets_a.get('duration')),
+        onset_train(onsets_b['onset_times'], onsets_b.get('onset_strengths'), onsets_b.get('duration'))
+    )
+    return score >= MIN_ONSET_CORRELATION
@@ -1,160 +1,517 @@
+import bisect
+import math
 import random
 import numpy as np
 
-def generate_beat_map(analysis_data, lyrics_text=None, monotone_factor=0.5, case_sensitive=False, include_spaces=True):
+# Minimum spacing between two playable rhythm points (seconds)
+MIN_NOTE_GAP = 0.15
+
+# Bump when the rhythm grid derivation changes so stored grids get rebuilt
+RHYTHM_GRID_VERSION = 2
+
+def filter_min_gap(times, min_gap=MIN_NOTE_GAP):
+    """
+    Drops points closer than min_gap to the previously kept point.
+    times must be sorted. Returns a numpy array.
+    """
+    times = np.asarray(times, dtype=float)
+    if times.size == 0:
+        return times
+
+    # For every point, index of the first point more than min_gap after it.
+    # Walking this chain from 0 visits exactly the points the greedy filter keeps.
+    next_index = np.searchsorted(times, times + min_gap, side='right')
+    keep = []
+    i = 0
+    while i < times.size:
+        keep.append(i)
+        i = next_index[i]
+    return times[keep]
+
+def build_rhythm_grid(beat_times, onset_times, min_gap=MIN_NOTE_GAP):
+    """
+    Merges beats and onsets into the sorted, gap-filtered grid used by Zen mode.
+    Returns a dict with the grid version, the times rounded to milliseconds
+    and the first beat.
+    """
+    if beat_times is None:
+        beat_times = []
+    if onset_times is None:
+        onset_times = []
+    combined = np.sort(np.concatenate([
+        np.asarray(beat_times, dtype=float),
+        np.asarray(onset_times, dtype=float)
+    ]))
+    grid = filter_min_gap(combined, min_gap)
+    return {
+        'version': RHYTHM_GRID_VERSION,
+        'times': np.round(grid, 3).tolist(),
+        # Zen mode reveals the first word relative to the first beat, not the first onset
+        'first_beat': round(float(np.min(beat_times)), 3) if len(beat_times) else None
+    }
+
+# Share of the ranked off-beat onsets each difficulty tier may use,
+# before scaling by (1 - monotone_factor)
+DIFFICULTY_TIERS = {
+    'easy': 0.15,
+    'normal': 0.5,
+    'hard': 1.0
+}
+DEFAULT_TIER = 'normal'
+
+def rank_onsets(beat_times, onset_times, onset_strengths=None, threshold=0.1):
+    """
+    Ranks off-beat onsets by how worth adding they are: stronger onsets that
+    sit further from the nearest beat come first.
+    Returns (rank, n_candidates) where rank[i] is the position of onset i in the
+    ranking; onsets within threshold of a beat are ranked after all candidates.
+    """
+    beat_times = np.asarray(beat_times, dtype=float)
+    onset_times = np.asarray(onset_times, dtype=float)
+    if onset_times.size == 0 or beat_times.size == 0:
+        return np.full(onset_times.size, onset_times.size, dtype=int), 0
+
+    # Distance to the nearest beat via the neighbouring beats on either side
+    idx = np.searchsorted(beat_times, onset_times)
+    left = beat_times[np.clip(idx - 1, 0, beat_times.size - 1)]
+    right = beat_times[np.clip(idx, 0, beat_times.size - 1)]
+    dist = np.minimum(np.abs(onset_times - left), np.abs(right - onset_times))
+
+    if onset_strengths is not None and len(onset_strengths) == onset_times.size:
+        strength = np.asarray(onset_strengths, dtype=float)
+        peak = strength.max()
+        strength = strength / peak if peak > 0 else np.ones_like(strength)
+    else:
+        strength = np.ones_like(onset_times)
+
+    candidate = dist > threshold
+    # Distance bonus saturates so far-off-beat noise does not beat real hits
+    score = np.where(candidate, strength * np.minimum(dist / threshold, 3.0), -np.inf)
+
+    order = np.argsort(-score, kind='stable')
+    rank = np.empty(onset_times.size, dtype=int)
+    rank[order] = np.arange(onset_times.size)
+    return rank, int(candidate.sum())
+
+def generate_beat_map(analysis_data, lyrics_text=None, monotone_factor=0.5, case_sensitive=False, include_spaces=True, tiers=DIFFICULTY_TIERS, timed_lyrics=None):
     """
-    Generates a list of notes based on audio analysis and lyrics.
+    Generates every difficulty tier from a single ranking of the off-beat onsets.
     monotone_factor: 0.0 (chaotic/all onsets) to 1.0 (strict beat only)
     case_sensitive: Boolean, if True, keeps original case.
     include_spaces: Boolean, if True, includes space characters in the beatmap.
-    Returns a tuple: (notes_list, difficulty_score)
+    timed_lyrics: optional list of (seconds, line) tuples; if given, characters
+    are aligned to when they are sung instead of cycling through lyrics_text.
+    Tiers share one character sequence and only store their note times
+    (aligned tiers store their own characters);
+    use get_tier_notes() to expand a tier into note objects.
+    Returns a tuple: (beat_map, difficulty_score of the default tier)
     """
     if not analysis_data:
-        return [], 1
-
-    beat_times = np.array(analysis_data.get('beat_times', []))
-    onset_times = np.array(analysis_data.get('onset_times', []))
-    
-    combined_times = []
-    
-    # Add all beats
-    for t in beat_times:
-        combined_times.append(t)
-        
-    # Add onsets based on monotone_factor
-    threshold = 0.1
-    base_prob = 0.55 * (1.0 - monotone_factor)
-    added_counter = 0
-    
-    for onset in onset_times:
-        if len(beat_times) > 0:
-            dist = np.min(np.abs(beat_times - onset))
-            if dist > threshold:
-                prob = (dist / threshold) * base_prob
-                if random.random() < prob:
-                    added_counter += 1
-                    combined_times.append(onset)
-    if len(onset_times) > 0:
-        print(f"{added_counter / len(onset_times) * 100} percent of off-beats were added")
-    else:
-        print("No onset times available for off-beats.")
-                
-    combined_times.sort()
-    
-    # Filter out times that are too close
-    filtered_times = []
-    last_t = -1
-    min_gap = 0.15 
-    
-    for t in combined_times:
-        if t - last_t > min_gap:
-            filtered_times.append(t)
-            last_t = t
-            
+        return {}, 1
+
+    beat_times = np.asarray(analysis_data.get('beat_times') or [], dtype=float)
+    onset_times = np.asarray(analysis_data.get('onset_times') or [], dtype=float)
+    duration = analysis_data.get('duration', 1)
+
+    rank, n_candidates = rank_onsets(beat_times, onset_times, analysis_data.get('onset_strengths'))
+    budget = n_candidates * (1.0 - monotone_factor)
+
     start_offset = 2.0
-    valid_times = [t for t in filtered_times if t > start_offset]
-    
-    notes = map_lyrics_to_beats(valid_times, lyrics_text, case_sensitive, include_spaces)
-            
-    difficulty = calculate_difficulty(notes, analysis_data.get('duration', 1), case_sensitive)
-        
-    return {
-        'notes': notes,
-        'difficulty': difficulty,
+    tier_times = {}
+    for name, share in tiers.items():
+        # Each tier takes a prefix of the same ranking
+        chosen = onset_times[rank < int(round(budget * share))]
+        combined = np.sort(np.concatenate([beat_times, chosen]))
+        filtered = filter_min_gap(combined)
+        tier_times[name] = filtered[filtered > start_offset].tolist()
+        if n_candidates:
+            print(f"{name}: {len(chosen) / n_candidates * 100:.1f} percent of off-beats were added")
+
+    sung_chars, targets = timed_lyrics_to_targets(timed_lyrics, case_sensitive, include_spaces)
+    aligned = len(sung_chars) > 0
+    if aligned:
+        chars = []
+    else:
+        longest = max((len(t) for t in tier_times.values()), default=0)
+        chars = lyrics_to_chars(lyrics_text, longest, case_sensitive, include_spaces)
+
+    beat_map = {
+        'chars': ''.join(chars),
+        'tiers': {},
+        'default_tier': DEFAULT_TIER if DEFAULT_TIER in tier_times else next(iter(tier_times), None),
         'case_sensitive': case_sensitive,
         'include_spaces': include_spaces
-    }, difficulty
+    }
+    for name, times in tier_times.items():
+        entry = {}
+        if aligned:
+            times, tier_chars = align_chars_to_times(times, sung_chars, targets)
+            entry['chars'] = ''.join(tier_chars)
+            notes = build_notes(times, tier_chars, case_sensitive)
+        else:
+            notes = build_notes(times, chars, case_sensitive)
+        strain = compute_strain(notes, duration, case_sensitive)
+        entry.update({
+            'times': times,
+            'difficulty': calculate_difficulty(notes, duration, case_sensitive, strain),
+            'strain': strain
+        })
+        beat_map['tiers'][name] = entry
+
+    default = beat_map['tiers'].get(beat_map['default_tier'])
+    difficulty = default['difficulty'] if default else 1
+    beat_map['difficulty'] = difficulty
+    return beat_map, difficulty
+
+def get_tier_notes(beat_map, tier=None):
+    """
+    Returns the note objects of one tier, falling back to the default tier.
+    Single-map beatmaps (e.g. saved from the editor) are returned as-is.
+    Returns a tuple: (notes_list, tier_name, difficulty)
+    """
+    if not beat_map:
+        return [], None, 1
+    if 'tiers' not in beat_map:
+        return beat_map.get('notes', []), None, beat_map.get('difficulty', 1)
+
+    if tier not in beat_map['tiers']:
+        tier = beat_map.get('default_tier')
+    entry = beat_map['tiers'].get(tier)
+    if not entry:
+        return [], None, beat_map.get('difficulty', 1)
+
+    chars = entry.get('chars', beat_map.get('chars', ''))
+    notes = build_notes(entry['times'], chars, beat_map.get('case_sensitive', False))
+    return notes, tier, entry['difficulty']
 
-def map_lyrics_to_beats(valid_times, lyrics_text, case_sensitive=False, include_spaces=True):
+def playable_content(beat_map):
+    """
+    The parts of a stored beatmap that decide what is played: every tier's
+    note times and characters plus the typing options, without scores.
+    Beatmaps with equal content play identically.
+    """
+    if not beat_map:
+        return None
+    names = list(beat_map['tiers']) if 'tiers' in beat_map else [None]
+    return {
+        'tiers': {name: [(n['time'], n['char']) for n in get_tier_notes(beat_map, name)[0]] for name in names},
+        'default_tier': beat_map.get('default_tier'),
+        'case_sensitive': beat_map.get('case_sensitive', False),
+        'include_spaces': beat_map.get('include_spaces', False)
+    }
+
+def build_notes(times, chars, case_sensitive=False):
+    """Pairs note times with characters in order."""
     notes = []
-    if lyrics_text:
-        # Remove newlines and extra spaces
-        clean_text = " ".join(lyrics_text.split())
-        
-        # Handle case sensitivity
+    for time, char in zip(times, chars):
+        notes.append({
+            'time': time,
+            'key': char if case_sensitive else char.lower(),
+            'char': char,
+            'is_space': char == ' '
+        })
+    return notes
+
+# Windowed note streaming for long sessions
+NOTE_WINDOW = 30.0        # seconds of notes per window
+MAX_NOTE_WINDOW = 120.0
+
+def build_note_index(beat_map, tier=None):
+    """
+    Flattens one tier of a beatmap into parallel, time-sorted lists so windows
+    can be cut with a binary search instead of rebuilding every note.
+    Returns a dict with times, chars and the tier summary fields.
+    """
+    beat_map = beat_map or {}
+    case_sensitive = beat_map.get('case_sensitive', False)
+    if 'tiers' in beat_map:
+        if tier not in beat_map['tiers']:
+            tier = beat_map.get('default_tier')
+        entry = beat_map['tiers'].get(tier) or {}
+        times = list(entry.get('times', []))
+        chars = entry.get('chars', beat_map.get('chars', ''))[:len(times)]
+        difficulty = entry.get('difficulty', beat_map.get('difficulty', 1))
+        if not entry:
+            tier = None
+    else:
+        # Single-map beatmaps (e.g. saved from the editor) may be unsorted
+        notes = sorted(beat_map.get('notes', []), key=lambda n: n['time'])
+        times = [n['time'] for n in notes]
+        chars = [n.get('char', n.get('key', '')) for n in notes]
+        difficulty = beat_map.get('difficulty', 1)
+        tier = None
+
+    return {
+        'times': times,
+        'chars': chars,
+        'tier': tier,
+        'tiers': {name: entry['difficulty'] for name, entry in beat_map.get('tiers', {}).items()},
+        'difficulty': difficulty,
+        'case_sensitive': case_sensitive,
+        'include_spaces': beat_map.get('include_spaces', False)
+    }
+
+def note_window(index, start, end):
+    """
+    Returns the notes with start <= time < end from a note index.
+    Returns a tuple: (index_of_first_note, notes_list)
+    """
+    times = index['times']
+    lo = bisect.bisect_left(times, start)
+    hi = bisect.bisect_left(times, end, lo)
+    return lo, build_notes(times[lo:hi], index['chars'][lo:hi], index['case_sensitive'])
+
+def lyrics_char_sequence(lyrics_text, case_sensitive=False, include_spaces=True):
+    """
+    Returns the typeable characters of the lyrics, in order, as a list.
+    Returns an empty list when there are no lyrics.
+    """
+    if not lyrics_text:
+        return []
+
+    # Remove newlines and extra spaces
+    clean_text = " ".join(lyrics_text.split())
+
+    # Handle case sensitivity
+    if not case_sensitive:
+        clean_text = clean_text.upper()
+
+    # Create a clean list of chars to map
+    # Include spaces only if include_spaces is True
+    if include_spaces:
+        chars_to_map = [c for c in clean_text if c.isalnum() or c.isspace()]
+    else:
+        chars_to_map = [c for c in clean_text if c.isalnum()]
+
+    if not chars_to_map:
+        chars_to_map = ["A"] # Fallback
+
+    return chars_to_map
+
+def lyrics_to_chars(lyrics_text, count, case_sensitive=False, include_spaces=True):
+    """
+    Returns the first `count` characters to type, cycling through the lyrics.
+    Without lyrics random letters are used.
+    """
+    if not lyrics_text:
+        chars = [random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(count)]
+        return chars if case_sensitive else [c.upper() for c in chars]
+
+    chars_to_map = lyrics_char_sequence(lyrics_text, case_sensitive, include_spaces)
+    return [chars_to_map[i % len(chars_to_map)] for i in range(count)]
+
+# Two editor timestamps closer than this are the same note (seconds)
+NOTE_TIME_TOLERANCE = 1e-4
+
+def _note_time(value):
+    t = float(value)
+    if not math.isfinite(t) or t < 0:
+        raise ValueError(f"Invalid note time: {value}")
+    return t
+
+def note_patch_steps(ops):
+    """
+    Validates editor deltas and flattens them into ('add' | 'remove', time)
+    steps, in order. ops: list of {'op': 'add', 'time': t},
+    {'op': 'remove', 'time': t} or {'op': 'move', 'from': t0, 'to': t1}.
+    Times must be finite and non-negative.
+    Raises ValueError (or KeyError/TypeError) on malformed input.
+    """
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        raise ValueError("ops must be a list of objects")
+
+    steps = []
+    for op in ops:
+        kind = op.get('op')
+        if kind == 'add':
+            steps.append(('add', _note_time(op['time'])))
+        elif kind == 'remove':
+            steps.append(('remove', _note_time(op['time'])))
+        elif kind == 'move':
+            steps.append(('remove', _note_time(op['from'])))
+            steps.append(('add', _note_time(op['to'])))
+        else:
+            raise ValueError(f"Unknown patch op: {kind}")
+    return steps
+
+# Timed-lyrics alignment parameters
+MAX_CHAR_DURATION = 0.35   # longest a single sung character is assumed to last (seconds)
+MAX_ALIGN_OFFSET = 0.75    # beats further than this from any sung character get no note
+
+def timed_lyrics_to_targets(timed_lyrics, case_sensitive=False, include_spaces=True):
+    """
+    Spreads the characters of each timestamped lyric line evenly over the time
+    until the next line (capped at MAX_CHAR_DURATION per character).
+    Returns (chars, target_times) with target_times sorted ascending.
+    """
+    if not timed_lyrics:
+        return [], np.array([])
+
+    starts = []
+    line_chars = []
+    for time, text in sorted(timed_lyrics, key=lambda line: line[0]):
+        clean_text = " ".join(text.split())
         if not case_sensitive:
             clean_text = clean_text.upper()
-        
-        text_index = 0
-        time_index = 0
-        
-        # Create a clean list of chars to map
-        # Include spaces only if include_spaces is True
         if include_spaces:
-            chars_to_map = [c for c in clean_text if c.isalnum() or c.isspace()]
+            chars = [c for c in clean_text if c.isalnum() or c.isspace()]
+            # Line breaks act as word breaks
+            if chars:
+                chars.append(' ')
         else:
-            chars_to_map = [c for c in clean_text if c.isalnum()]
-        
-        if not chars_to_map:
-             chars_to_map = ["A"] # Fallback
-             
-        while time_index < len(valid_times):
-            char = chars_to_map[text_index % len(chars_to_map)]
-            
-            time = valid_times[time_index]
-            
-            notes.append({
-                'time': time,
-                'key': char if case_sensitive else char.lower(), 
-                'char': char, 
-                'is_space': char == ' '
-            })
-            
-            text_index += 1
-            time_index += 1
-            
-    else:
-        chars = "abcdefghijklmnopqrstuvwxyz"
-        for t in valid_times:
-            char = random.choice(chars)
-            notes.append({
-                'time': t,
-                'key': char,
-                'char': char if case_sensitive else char.upper(),
-                'is_space': False
-            })
-    return notes
+            chars = [c for c in clean_text if c.isalnum()]
+        starts.append(float(time))
+        line_chars.append(chars)
+
+    # Empty (instrumental) lines still mark where the previous line ends
+    starts = np.array(starts)
+    counts = np.array([len(chars) for chars in line_chars])
+    next_starts = np.append(starts[1:], np.inf)
+    spans = np.minimum(next_starts - starts, counts * MAX_CHAR_DURATION)
+
+    chars = [c for line in line_chars for c in line]
+    if include_spaces and chars:
+        chars.pop()  # no trailing word break after the last line
+    if not chars:
+        return [], np.array([])
+
+    # Position of every character inside its line, without a Python loop
+    line_of_char = np.repeat(np.arange(counts.size), counts)[:len(chars)]
+    first_of_line = np.repeat(np.cumsum(counts) - counts, counts)[:len(chars)]
+    position = np.arange(len(chars)) - first_of_line
+    targets = starts[line_of_char] + (position + 0.5) / counts[line_of_char] * spans[line_of_char]
+    return chars, targets
+
+def align_chars_to_times(times, chars, targets, max_offset=MAX_ALIGN_OFFSET):
+    """
+    Monotonically assigns sung characters to note times in O(n log n).
+    Every time takes its nearest character target; when several times want the
+    same character only the closest keeps it, and times further than max_offset
+    from any character are dropped. Characters without a time are skipped.
+    Returns (kept_times, chars) as lists.
+    """
+    times = np.asarray(times, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    if times.size == 0 or targets.size == 0:
+        return [], []
+
+    idx = np.searchsorted(targets, times)
+    left = np.clip(idx - 1, 0, targets.size - 1)
+    right = np.clip(idx, 0, targets.size - 1)
+    nearest = np.where(np.abs(times - targets[left]) <= np.abs(targets[right] - times), left, right)
+    dist = np.abs(times - targets[nearest])
+
+    # Both inputs are sorted, so nearest is non-decreasing: deduping it keeps
+    # the assignment strictly monotonic
+    candidates = np.nonzero(dist <= max_offset)[0]
+    nearest = nearest[candidates]
+    order = np.lexsort((dist[candidates], nearest))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = nearest[order][1:] != nearest[order][:-1]
+    keep = np.sort(order[first])
+
+    char_array = np.array(chars)
+    return times[candidates[keep]].tolist(), char_array[nearest[keep]].tolist()
+
+def map_lyrics_to_beats(valid_times, lyrics_text, case_sensitive=False, include_spaces=True, timed_lyrics=None):
+    sung_chars, targets = timed_lyrics_to_targets(timed_lyrics, case_sensitive, include_spaces)
+    if sung_chars:
+        times, chars = align_chars_to_times(valid_times, sung_chars, targets)
+        return build_notes(times, chars, case_sensitive)
+
+    chars = lyrics_to_chars(lyrics_text, len(valid_times), case_sensitive, include_spaces)
+    return build_notes(valid_times, chars, case_sensitive)
+
+# Strain model parameters
+STRAIN_WINDOW = 2.0         # seconds of notes that count towards the strain at a point
+STRAIN_CURVE_POINTS = 100   # resolution of the stored, downsampled strain curve
+
+# Approximate QWERTY key centres (column, row) used for finger travel
+KEY_POSITIONS = {}
+for _row, (_offset, _keys) in enumerate([(0.0, '1234567890'), (0.5, 'qwertyuiop'), (0.75, 'asdfghjkl'), (1.25, 'zxcvbnm')]):
+    for _col, _key in enumerate(_keys):
+        KEY_POSITIONS[_key] = (_offset + _col, float(_row))
+KEY_POSITIONS[' '] = (5.0, 4.0)
+DEFAULT_KEY_POSITION = (4.5, 1.5)
+
+def compute_strain(notes, duration, case_sensitive=False, window=STRAIN_WINDOW, points=STRAIN_CURVE_POINTS):
+    """
+    Computes a rolling strain curve for a sorted list of notes.
+    Every note is weighted by rhythm changes, finger travel from the previous key
+    and, when case_sensitive, uppercase/shift changes. The strain at a note is the
+    weighted number of notes per second over the preceding window.
+    Returns a dict with the downsampled curve (per-bin maximum) and the peak and
+    average strain.
+    """
+    if not duration or duration <= 0: duration = 1
+    if not notes:
+        return {'curve': [], 'peak': 0.0, 'average': 0.0}
+
+    times = np.array([n['time'] for n in notes], dtype=float)
+    chars = [n.get('char') or n.get('key') or '' for n in notes]
+    weight = np.ones(times.size)
+
+    if times.size > 1:
+        # Rhythm changes: how much each interval differs from the previous one
+        intervals = np.maximum(np.diff(times), 0.05)
+        rhythm_change = np.abs(np.log(intervals[1:] / intervals[:-1]))
+        weight[2:] += 0.3 * np.minimum(rhythm_change, 1.0)
+
+        # Finger travel between consecutive keys
+        positions = np.array([KEY_POSITIONS.get(c.lower(), DEFAULT_KEY_POSITION) for c in chars])
+        travel = np.hypot(*(positions[1:] - positions[:-1]).T)
+        weight[1:] += 0.1 * np.minimum(travel, 5.0)
 
-def calculate_difficulty(notes, duration, case_sensitive=False):
-    if duration <= 0: duration = 1
-    
-    # 1. Density (NPS)
-    nps = len(notes) / duration
-    
-    # 2. Complexity (Interval Jitter)
-    # Calculate time differences between notes
-    intervals = []
-    for i in range(1, len(notes)):
-        diff = notes[i]['time'] - notes[i-1]['time']
-        intervals.append(diff)
-        
-    variance_score = 0
-    if intervals:
-        avg_interval = sum(intervals) / len(intervals)
-        if avg_interval > 0:
-            std_dev = np.std(intervals)
-            # COV: Coefficient of Variation
-            variance_score = std_dev / avg_interval
-            
-    # Base Score formulation
-    # NPS is dominant. 
-    score = nps * 1.0
-    
-    # Adjust for complexity (irregularity makes it harder)
-    # If variance is high (e.g. > 0.5), boost score
-    # We cap the boost to avoid it becoming too crazy
-    complexity_mult = 1.0 + (min(variance_score, 1.0) * 0.3)
-    score *= complexity_mult
-    
-    # 3. Mechanical Modifiers
     if case_sensitive:
-        score *= 1.6 # 60% harder
-    
-    # Mapping to 1-5 scale (adjusted thresholds)
-    if score < 1.5: difficulty = 1
-    elif score < 2.5: difficulty = 2
-    elif score < 4.0: difficulty = 3
-    elif score < 6.0: difficulty = 4
+        upper = np.array([c.isupper() for c in chars])
+        weight[upper] *= 1.2
+        # Pressing or releasing shift between two notes
+        case_change = np.concatenate([[False], upper[1:] != upper[:-1]])
+        weight[case_change] *= 1.3
+
+    # Weighted notes-per-second over (t - window, t] for every note
+    cumulative = np.concatenate([[0.0], np.cumsum(weight)])
+    hi = np.searchsorted(times, times, side='right')
+    lo = np.searchsorted(times, times - window, side='right')
+    note_strain = (cumulative[hi] - cumulative[lo]) / window
+
+    # Keep the hardest moment of every bin so short spikes survive downsampling
+    bins = np.clip((times / duration * points).astype(int), 0, points - 1)
+    curve = np.zeros(points)
+    np.maximum.at(curve, bins, note_strain)
+
+    return {
+        'curve': np.round(curve, 2).tolist(),
+        'peak': round(float(note_strain.max()), 3),
+        'average': round(float(note_strain.mean()), 3)
+    }
+
+def calculate_difficulty(notes, duration, case_sensitive=False, strain=None):
+    """
+    Maps the strain of a beatmap to a 1-5 star rating.
+    The peak dominates, so one brutal section outranks an evenly moderate song.
+    """
+    if strain is None:
+        strain = compute_strain(notes, duration, case_sensitive)
+
+    score = 0.65 * strain['peak'] + 0.35 * strain['average']
+
+    # Mapping to 1-5 scale
+    if score < 2.0: difficulty = 1
+    elif score < 3.25: difficulty = 2
+    elif score < 5.0: difficulty = 3
+    elif score < 7.5: difficulty = 4
     else: difficulty = 5
-    
-    return difficulty
\ No newline at end of file
+
+    return difficulty
+
+def get_beat_map_strain(beat_map, tier=None):
+    """Returns the stored strain of a tier (default tier) or single-map beatmap."""
+    if not beat_map:
+        return None
+    if 'tiers' not in beat_map:
+        return beat_map.get('strain')
+    if tier not in beat_map['tiers']:
+        tier = beat_map.get('default_tier')
+    entry = beat_map['tiers'].get(tier)
+    return entry.get('strain') if entry else None
@@ -0,0 +1,422 @@
+"""
+Local load-test harness.
+
+Starts the app in a subprocess against a throwaway SQLite database (or any
+DATABASE_URL you pass), seeds it with synthetic songs, then drives each
+scenario with concurrent clients and reports latency percentiles, throughput,
+error rate and server RSS as JSON.
+
+    python load_test.py run --songs 50 --concurrency 16 --duration 20 --out before.json
+    python load_test.py run --db-url postgresql://localhost/typing_load --out after.json
+    python load_test.py run --db-url postgresql://localhost:5432/typing_load \
+        --replica-url postgresql://localhost:5433/typing_load --reset-replica --out split.json
+    python load_test.py compare before.json after.json
+
+/process_song runs with download_audio stubbed to locally synthesized click
+tracks, so no network access is needed; analysis and beatmap generation run for real.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = ['menu', 'game', 'audio_seek', 'ingest']
+SONG_ID_PREFIX = 'load_'
+AUDIO_BYTES_PER_SECOND = 16000  # ~128 kbps mp3
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+def synth_click_track(path, seed, seconds=30, sr=22050):
+    """
+    Writes a mono WAV click track whose tempo and melody depend on seed.
+    Every click gets its own random semitone, so tracks with different seeds
+    never look like duplicates to the ingest fingerprint check.
+    """
+    import wave
+    import numpy as np
+
+    rng = random.Random(seed)
+    bpm = rng.uniform(80, 160)
+    t = np.arange(int(seconds * sr)) / sr
+    y = np.zeros_like(t)
+    tone = t[:int(0.15 * sr)]
+    for beat in np.arange(0, seconds, 60.0 / bpm):
+        pitch = 220.0 * 2 ** (rng.randrange(24) / 12)
+        click = np.sin(2 * np.pi * pitch * tone) * np.exp(-tone * 20)
+        start = int(beat * sr)
+        end = min(start + click.size, y.size)
+        y[start:end] += click[:end - start]
+    pcm = (np.clip(y, -1, 1) * 32767).astype('<i2')
+
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(pcm.tobytes())
+
+def make_download_stub(workdir):
+    """Replacement for audio_engine.download_audio that never touches the network."""
+    def download_audio(youtube_url):
+        video_id = youtube_url.split("v=")[1].split("&")[0] if "v=" in youtube_url else "unknown_video"
+        path = os.path.join(workdir, f"{video_id}.wav")
+        synth_click_track(path, video_id)
+        return path, video_id, f"Load Test {video_id}"
+    return download_audio
+
+def seed_database(db, Song, count, duration):
+    """Inserts synthetic songs with realistic analysis and beatmap sizes."""
+    from game_engine import generate_beat_map, build_rhythm_grid
+
+    existing = {song.id for song in Song.query.filter(Song.id.like(f"{SONG_ID_PREFIX}%")).all()}
+    rng = random.Random(42)
+    for i in range(count):
+        video_id = f"{SONG_ID_PREFIX}{i:04d}"
+        if video_id in existing:
+            continue
+        interval = 60.0 / rng.uniform(80, 160)
+        beat_times = [round(t * interval, 3) for t in range(int(duration / interval))]
+        onset_times = sorted(round(rng.uniform(0, duration), 3) for _ in range(len(beat_times) * 2))
+        analysis = {
+            'bpm': 60.0 / interval,
+            'duration': duration,
+            'beat_times': beat_times,
+            'onset_times': onset_times,
+            'onset_strengths': [rng.random() for _ in onset_times]
+        }
+        beat_map, difficulty = generate_beat_map(analysis, "the quick brown fox jumps over the lazy dog", 0.45, False, True)
+        song = Song(
+            id=video_id,
+            title=f"Synthetic Song {i}",
+            duration=duration,
+            bpm=analysis['bpm'],
+            difficulty=difficulty,
+            beat_times=beat_times,
+            onset_times=onset_times,
+            onset_strengths=analysis['onset_strengths'],
+            rhythm_grid=build_rhythm_grid(beat_times, onset_times),
+            beat_map=beat_map,
+            audio_file=os.urandom(int(duration * AUDIO_BYTES_PER_SECOND)),
+            case_sensitive=False,
+            include_spaces=True
+        )
+        db.session.add(song)
+        if i % 20 == 19:
+            db.session.commit()
+    db.session.commit()
+
+LOCAL_HOSTS = {None, '', 'localhost', '127.0.0.1', '::1'}
+
+def copy_to_replica(db, reset=False):
+    """
+    Mirrors the seeded tables onto the replica engine, standing in for replication.
+    The replica is only wiped with reset=True; otherwise it must be a local
+    database whose tables are still empty.
+    """
+    from sqlalchemy import func, inspect, select
+
+    replica = db.engines['replica']
+    if reset:
+        db.metadata.drop_all(replica)
+    else:
+        url = replica.url.render_as_string(hide_password=True)
+        if replica.url.host not in LOCAL_HOSTS:
+            raise RuntimeError(f"Refusing to write to non-local replica {url} (pass --reset-replica to allow)")
+        existing = set(inspect(replica).get_table_names())
+        with replica.connect() as conn:
+            for table in db.metadata.sorted_tables:
+                if table.name in existing and conn.execute(select(func.count()).select_from(table)).scalar():
+                    raise RuntimeError(f"Replica {url} already has rows in {table.name} (pass --reset-replica to drop them)")
+    db.metadata.create_all(replica)
+    with db.engines[None].connect() as src, replica.begin() as dst:
+        for table in db.metadata.sorted_tables:
+            rows = [dict(row._mapping) for row in src.execute(table.select())]
+            if rows:
+                dst.execute(table.insert(), rows)
+
+def serve(args):
+    # app.py reads DATABASE_URL / DATABASE_REPLICA_URL at import time
+    os.environ['DATABASE_URL'] = args.db_url
+    if args.replica_url:
+        os.environ['DATABASE_REPLICA_URL'] = args.replica_url
+    workdir = tempfile.mkdtemp(prefix='typing_load_audio_')
+
+    import app as app_module
+    from models import db, Song
+
+    app_module.download_audio = make_download_stub(workdir)
+    with app_module.app.app_context():
+        db.create_all()
+        seed_database(db, Song, args.songs, args.song_duration)
+        if args.replica_url:
+            # Songs ingested during the run only reach the primary, like replication lag
+            copy_to_replica(db, reset=args.reset_replica)
+
+    print("Load-test server ready", flush=True)
+    app_module.socketio.run(app_module.app, host='127.0.0.1', port=args.port, debug=False, allow_unsafe_werkzeug=True)
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+def read_rss_mb(pid):
+    """Resident set size of a process in MB (Linux /proc), or None."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def http(method, url, body=None, headers=None, timeout=120):
+    """Performs one request and returns the status code (0 on connection errors)."""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+    if data is not None:
+        request.add_header('Content-Type', 'application/json')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception:
+        return 0
+
+def make_request_factory(name, base_url, song_ids, song_duration):
+    """Returns a callable performing one request of the given scenario."""
+    audio_size = int(song_duration * AUDIO_BYTES_PER_SECOND)
+
+    if name == 'menu':
+        return lambda: http('GET', f"{base_url}/")
+    if name == 'game':
+        return lambda: http('GET', f"{base_url}/game/{random.choice(song_ids)}")
+    if name == 'audio_seek':
+        def seek():
+            # Browsers seek with open-ended ranges from a random offset
+            start = random.randint(0, audio_size - 1)
+            return http('GET', f"{base_url}/audio/{random.choice(song_ids)}", headers={'Range': f"bytes={start}-"})
+        return seek
+    if name == 'ingest':
+        def ingest():
+            video_id = f"ingest_{random.getrandbits(48):012x}"
+            return http('POST', f"{base_url}/process_song", body={'url': f"https://www.youtube.com/watch?v={video_id}"})
+        return ingest
+    raise ValueError(f"Unknown scenario: {name}")
+
+def run_scenario(name, make_request, concurrency, duration, server_pid):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    rss_samples = []
+    deadline = time.monotonic() + duration
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.is_set():
+            rss = read_rss_mb(server_pid)
+            if rss is not None:
+                rss_samples.append(rss)
+            stop.wait(0.5)
+
+    def worker():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            status = make_request()
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if not 200 <= status < 400:
+                    errors += 1
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.monotonic() - started
+    stop.set()
+    sampler.join()
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': errors,
+        'error_rate': round(errors / count, 4) if count else None,
+        'throughput_rps': round(count / wall, 2) if wall > 0 else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2) if count else None,
+            'p95': round(percentile(latencies, 95), 2) if count else None,
+            'p99': round(percentile(latencies, 99), 2) if count else None,
+            'mean': round(sum(latencies) / count, 2) if count else None,
+            'max': round(latencies[-1], 2) if count else None
+        },
+        'worker_rss_mb': {
+            'start': round(rss_samples[0], 1) if rss_samples else None,
+            'peak': round(max(rss_samples), 1) if rss_samples else None,
+            'end': round(rss_samples[-1], 1) if rss_samples else None
+        }
+    }
+
+def wait_for_server(base_url, proc, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        if http('GET', f"{base_url}/favicon.ico", timeout=2) == 204:
+            return
+        time.sleep(0.5)
+    raise RuntimeError("Server did not become ready in time")
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def run(args):
+    db_url = args.db_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='typing_load_db_'), 'load.db')}"
+    base_url = f"http://127.0.0.1:{args.port}"
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+
+    server_cmd = [
+        sys.executable, os.path.abspath(__file__), 'serve',
+        '--db-url', db_url, '--port', str(args.port),
+        '--songs', str(args.songs), '--song-duration', str(args.song_duration)
+    ]
+    if args.replica_url:
+        server_cmd += ['--replica-url', args.replica_url]
+    if args.reset_replica:
+        server_cmd.append('--reset-replica')
+    proc = subprocess.Popen(server_cmd)
+    try:
+        wait_for_server(base_url, proc)
+        song_ids = [f"{SONG_ID_PREFIX}{i:04d}" for i in range(args.songs)]
+
+        results = []
+        for name in scenarios:
+            concurrency = args.ingest_concurrency if name == 'ingest' else args.concurrency
+            print(f"Running {name} ({concurrency} clients, {args.duration}s)...")
+            make_request = make_request_factory(name, base_url, song_ids, args.song_duration)
+            result = run_scenario(name, make_request, concurrency, args.duration, proc.pid)
+            print(f"  p50 {result['latency_ms']['p50']} ms, p95 {result['latency_ms']['p95']} ms, "
+                  f"p99 {result['latency_ms']['p99']} ms, {result['throughput_rps']} req/s, "
+                  f"errors {result['error_rate']}, peak RSS {result['worker_rss_mb']['peak']} MB")
+            results.append(result)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    report = {
+        'revision': git_revision(),
+        'date': datetime.utcnow().isoformat(),
+        'database': db_url.split('://')[0],
+        'replica': args.replica_url.split('://')[0] if args.replica_url else None,
+        'config': {
+            'songs': args.songs,
+            'song_duration': args.song_duration,
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'ingest_concurrency': args.ingest_concurrency
+        },
+        'scenarios': results
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    else:
+        print(json.dumps(report, indent=2))
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = {s['scenario']: s for s in json.load(f)['scenarios']}
+    with open(args.candidate) as f:
+        candidate = {s['scenario']: s for s in json.load(f)['scenarios']}
+
+    def delta(old, new):
+        if old is None or new is None:
+            return 'n/a'
+        if old == 0:
+            return f"{new}"
+        return f"{new} ({(new - old) / old * 100:+.1f}%)"
+
+    for name in [s for s in SCENARIOS if s in baseline or s in candidate]:
+        old, new = baseline.get(name), candidate.get(name)
+        if not old or not new:
+            print(f"{name}: only in {'baseline' if old else 'candidate'}")
+            continue
+        print(f"{name}:")
+        for pct in ('p50', 'p95', 'p99'):
+            print(f"  {pct:<12} {delta(old['latency_ms'][pct], new['latency_ms'][pct])} ms")
+        print(f"  {'throughput':<12} {delta(old['throughput_rps'], new['throughput_rps'])} req/s")
+        print(f"  {'error rate':<12} {delta(old['error_rate'], new['error_rate'])}")
+        print(f"  {'peak RSS':<12} {delta(old['worker_rss_mb']['peak'], new['worker_rss_mb']['peak'])} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Local load test for the typing rhythm server")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_server_args(p):
+        p.add_argument('--db-url', help="Database URL (default: throwaway SQLite file)")
+        p.add_argument('--replica-url', help="Optional read replica URL for the read-only routes")
+        p.add_argument('--reset-replica', action='store_true',
+                       help="Drop and recreate the replica's tables (needed for non-local or non-empty replicas)")
+        p.add_argument('--port', type=int, default=8765)
+        p.add_argument('--songs', type=int, default=50, help="Synthetic songs to seed")
+        p.add_argument('--song-duration', type=float, default=240.0, help="Length of each synthetic song (s)")
+
+    run_parser = sub.add_parser('run', help="Start a server, run the scenarios and report")
+    add_server_args(run_parser)
+    run_parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--ingest-concurrency', type=int, default=2)
+    run_parser.add_argument('--duration', type=float, default=20.0, help="Seconds per scenario")
+    run_parser.add_argument('--out', help="Write the JSON report here")
+    run_parser.set_defaults(func=run)
+
+    serve_parser = sub.add_parser('serve', help="(internal) run the seeded server")
+    add_server_args(serve_parser)
+    serve_parser.set_defaults(func=serve)
+
+    compare_parser = sub.add_parser('compare', help="Compare two JSON reports")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    if args.command == 'serve' and not args.db_url:
+        parser.error("serve needs --db-url")
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,11 @@ import re
 import random
 
 LYRICS_FOLDER = 'lyrics'
+STATIC_LYRICS_FOLDER = os.path.join('static', 'lyrics')
+
+# [mm:ss.xx] line timestamps and <mm:ss.xx> enhanced-LRC word timestamps
+LRC_TIMESTAMP = re.compile(r'\[(\d+):(\d+(?:\.\d+)?)\]')
+LRC_WORD_TIMESTAMP = re.compile(r'<\d+:\d+(?:\.\d+)?>')
 
 FALLBACK_LYRICS = [
     "The quick brown fox jumps over the lazy dog",
@@ -48,7 +53,7 @@ def get_lyrics(video_id):
     else:
         # Try to pick a random lyrics file from the static/lyrics folder
         try:
-            static_lyrics_dir = os.path.join('static', 'lyrics')
+            static_lyrics_dir = STATIC_LYRICS_FOLDER
             if os.path.exists(static_lyrics_dir):
                 files = [f for f in os.listdir(static_lyrics_dir) if f.endswith('.txt')]
                 if files:
@@ -79,3 +84,39 @@ def save_lyrics(video_id, text):
     path = os.path.join(LYRICS_FOLDER, f"{video_id}.txt")
     with open(path, 'w', encoding='utf-8') as f:
         f.write(text)
+
+def parse_lrc(text):
+    """
+    Parses LRC-style lyrics into a time-sorted list of (seconds, line) tuples.
+    Lines with several timestamps are repeated; metadata tags are ignored.
+    """
+    lines = []
+    for raw in text.splitlines():
+        stamps = LRC_TIMESTAMP.findall(raw)
+        if not stamps:
+            continue
+        line = LRC_TIMESTAMP.sub('', raw)
+        line = LRC_WORD_TIMESTAMP.sub('', line)
+        line = re.sub(r'\[.*?\]', '', line).strip()
+        for minutes, seconds in stamps:
+            lines.append((int(minutes) * 60 + float(seconds), line))
+    lines.sort(key=lambda l: l[0])
+    return lines
+
+def get_timed_lyrics(video_id):
+    """
+    Loads timestamped lyrics from a .lrc file next to the plain-text lyrics.
+    Returns a list of (seconds, line) tuples, or None if there is no usable file.
+    """
+    for folder in (STATIC_LYRICS_FOLDER, LYRICS_FOLDER):
+        path = os.path.join(folder, f"{video_id}.lrc")
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = parse_lrc(f.read())
+            if lines:
+                return lines
+        except Exception as e:
+            print(f"Error reading timed lyrics for {video_id}: {e}")
+    return None
@@ -0,0 +1,59 @@
+import sys
+from sqlalchemy import create_engine, inspect, text
+from models import db
+
+# Columns added to tables that already exist in deployed databases.
+# db.create_all() only creates missing tables, so every column added to an
+# existing model needs an entry here. Types and indexes come from the model.
+ADDED_COLUMNS = [
+    ('song', 'rhythm_grid'),
+    ('song', 'onset_strengths'),
+    ('song', 'peak_strain'),
+    ('song', 'avg_strain'),
+    ('song', 'audio_path'),
+    ('song', 'content_hash'),
+    ('song', 'duplicate_of'),
+    ('song', 'fingerprint'),
+    ('song', 'beat_map_revision'),
+]
+
+def upgrade_schema(engine):
+    """
+    Adds any missing ADDED_COLUMNS (and their indexes) to an existing database.
+    Safe to run repeatedly; tables that do not exist yet are left to create_all.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    added = []
+
+    with engine.begin() as conn:
+        for table_name, column_name in ADDED_COLUMNS:
+            if table_name not in tables:
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table_name)}
+            if column_name in existing:
+                continue
+            column = db.metadata.tables[table_name].c[column_name]
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+            added.append(f"{table_name}.{column_name}")
+
+    # Indexes on the added columns (no-op when they already exist)
+    for table_name, column_name in ADDED_COLUMNS:
+        if table_name not in tables:
+            continue
+        for index in db.metadata.tables[table_name].indexes:
+            if column_name in index.columns:
+                index.create(engine, checkfirst=True)
+
+    if added:
+        print(f"Added columns: {', '.join(added)}")
+    return added
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        upgrade_schema(create_engine(sys.argv[1].replace("postgres://", "postgresql://", 1)))
+    else:
+        from app import app
+        with app.app_context():
+            upgrade_schema(db.engine)
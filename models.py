@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import json
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Song(db.Model):
     id = db.Column(db.String(50), primary_key=True)  # YouTube Video ID
@@ -11,21 +12,47 @@ class Song(db.Model):
     duration = db.Column(db.Float)
     bpm = db.Column(db.Float)
     difficulty = db.Column(db.Float)
-    audio_file = db.Column(db.LargeBinary)
+    peak_strain = db.Column(db.Float, index=True)  # Hardest moment of the default beatmap
+    avg_strain = db.Column(db.Float)
+    audio_file = db.Column(db.LargeBinary)  # Whole audio of downloaded songs (uploads are stored as AudioChunk rows)
+    audio_path = db.Column(db.String(255))  # On-disk audio of uploads stored by older builds
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the audio file
+    duplicate_of = db.Column(db.String(50), index=True)  # Song whose audio/analysis this one reuses
     
     # Storing large arrays/dicts as JSON
     beat_times = db.Column(db.JSON)  # List of floats
     onset_times = db.Column(db.JSON) # List of floats
-    beat_map = db.Column(db.JSON)    # Full beatmap object
+    onset_strengths = db.Column(db.JSON) # Onset envelope value at each onset time
+    beat_map = db.Column(db.JSON)    # Full beatmap object (all difficulty tiers)
+    rhythm_grid = db.Column(db.JSON) # Merged, gap-filtered beats + onsets for Zen mode
+    fingerprint = db.Column(db.JSON) # Chroma/onset fingerprint vector (see fingerprint_engine)
+    fingerprint_bands = db.relationship('FingerprintBand', cascade='all, delete-orphan', lazy=True)
     
     case_sensitive = db.Column(db.Boolean, default=False)
     include_spaces = db.Column(db.Boolean, default=False)
     
-    version = db.Column(db.Integer, default=1)
+    version = db.Column(db.Integer, default=1)  # Changes when the notes do; scores and editor drafts are tied to it
+    beat_map_revision = db.Column(db.Integer, default=1)  # Changes on every beat_map write; keys the note index cache
     
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
 
-    def to_dict(self):
+    def to_dict(self, include_maps=True):
+        if not include_maps:
+            # Listing fields only, so deferred map/analysis columns stay unloaded
+            return {
+                'id': self.id,
+                'title': self.title,
+                'thumbnail': self.thumbnail_url,
+                'duration': self.duration,
+                'bpm': self.bpm,
+                'difficulty': self.difficulty,
+                'peak_strain': self.peak_strain,
+                'avg_strain': self.avg_strain,
+                'case_sensitive': self.case_sensitive,
+                'include_spaces': self.include_spaces,
+                'version': self.version or 1,
+                'date_added': self.date_added.isoformat() if self.date_added else None
+            }
         return {
             'id': self.id,
             'title': self.title,
@@ -33,6 +60,8 @@ class Song(db.Model):
             'duration': self.duration,
             'bpm': self.bpm,
             'difficulty': self.difficulty,
+            'peak_strain': self.peak_strain,
+            'avg_strain': self.avg_strain,
             'case_sensitive': self.case_sensitive,
             'include_spaces': self.include_spaces,
             'beat_map': self.beat_map,
@@ -48,3 +77,36 @@ class Song(db.Model):
             },
             'date_added': self.date_added.isoformat() if self.date_added else None
         }
+
+
+class FingerprintBand(db.Model):
+    """One SimHash band of a song fingerprint; songs sharing a band are duplicate candidates."""
+    id = db.Column(db.Integer, primary_key=True)
+    song_id = db.Column(db.String(50), db.ForeignKey('song.id', ondelete='CASCADE'), nullable=False, index=True)
+    band = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.Index('ix_fingerprint_band_key', 'band', 'key'),)
+
+
+class AudioChunk(db.Model):
+    """One fixed-size piece of an uploaded song's audio, so uploads are stored and read without holding the whole file."""
+    song_id = db.Column(db.String(50), db.ForeignKey('song.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class EditorDraft(db.Model):
+    """Unsaved editor changes to a song's beatmap, autosaved as note deltas until Save & Apply."""
+    song_id = db.Column(db.String(50), db.ForeignKey('song.id', ondelete='CASCADE'), primary_key=True)
+    base_version = db.Column(db.Integer, nullable=False)  # Song.version the draft was started from
+    revision = db.Column(db.Integer, nullable=False, default=0)  # Bumped by every autosave, for conflict detection
+
+
+class EditorNote(db.Model):
+    """One note time of an editor draft. The (song_id, time) index makes each delta a range lookup."""
+    id = db.Column(db.Integer, primary_key=True)
+    song_id = db.Column(db.String(50), db.ForeignKey('song.id', ondelete='CASCADE'), nullable=False)
+    time = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ix_editor_note_song_time', 'song_id', 'time'),)
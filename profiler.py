@@ -0,0 +1,137 @@
+import os
+import re
+import sys
+from collections import Counter, deque
+from datetime import datetime
+
+# The sampler must be a real OS thread even if eventlet has patched threading,
+# otherwise it could never run while a CPU-bound request holds the hub.
+try:
+    from eventlet.patcher import original
+    _threading = original('threading')
+    _time = original('time')
+except ImportError:
+    import threading as _threading
+    import time as _time
+
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000.0
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+
+class SamplingProfiler:
+    """
+    Samples the call stack of one thread at a fixed interval from a background
+    thread and aggregates the stacks in collapsed ("folded") form, which
+    flamegraph.pl, speedscope and inferno read directly.
+    Under eventlet all greenthreads share one OS thread, so when a greenlet is
+    given only its own stack is sampled: the live thread stack while it runs,
+    its suspended frame (e.g. waiting on I/O) while another greenthread does.
+    """
+    def __init__(self, thread_id, greenlet=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.greenlet = greenlet
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = _threading.Event()
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _frame(self):
+        if self.greenlet is not None:
+            if self.greenlet.dead:
+                return None
+            # gr_frame is None only while the greenlet is the one running
+            frame = self.greenlet.gr_frame
+            if frame is not None:
+                return frame
+        return sys._current_frames().get(self.thread_id)
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = self._frame()
+            if frame is not None:
+                self.stacks[self._collapse(frame)] += 1
+                self.samples += 1
+            _time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def start_profiler():
+    """Starts sampling the calling greenlet (or thread, without greenlet)."""
+    current = greenlet.getcurrent() if greenlet else None
+    return SamplingProfiler(_threading.get_ident(), current).start()
+
+class ProfileStore:
+    """Writes finished profiles to disk and keeps metadata for the most recent ones."""
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.recent = deque(maxlen=keep)
+        self._lock = _threading.Lock()
+
+    def save(self, profiler, method, path, endpoint, status, duration_ms, reason):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        started = datetime.utcnow()
+        safe_endpoint = re.sub(r'[^A-Za-z0-9_]+', '_', endpoint or 'unknown')
+        name = f"{started.strftime('%Y%m%dT%H%M%S%f')}_{safe_endpoint}_{int(duration_ms)}ms.folded"
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(profiler.folded())
+
+        entry = {
+            'name': name,
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round(duration_ms, 1),
+            'samples': profiler.samples,
+            'reason': reason,
+            'date': started.isoformat()
+        }
+        with self._lock:
+            if len(self.recent) == self.recent.maxlen:
+                self._remove_file(self.recent[0]['name'])
+            self.recent.append(entry)
+        return entry
+
+    def slowest(self, limit=50):
+        with self._lock:
+            entries = list(self.recent)
+        return sorted(entries, key=lambda e: e['duration_ms'], reverse=True)[:limit]
+
+    def path_for(self, name):
+        """Returns the file path of a stored profile, or None for unknown names."""
+        with self._lock:
+            known = any(e['name'] == name for e in self.recent)
+        return os.path.join(self.directory, name) if known else None
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
@@ -33,10 +33,22 @@ document.addEventListener('DOMContentLoaded', () => {
     const onsetTimes = (songData && songData.onset_times) ? songData.onset_times : [];
 
     let currentMap = new Set();
-    if (songData && songData.beat_map && songData.beat_map.notes) {
-        songData.beat_map.notes.forEach(note => currentMap.add(note.time));
+    if (songData && songData.note_times) {
+        songData.note_times.forEach(t => currentMap.add(t));
     }
 
+    // Autosave: add/remove deltas into the server-side draft, against the
+    // beatmap version and draft revision we started from. Save & Apply publishes.
+    const AUTOSAVE_DELAY_MS = 1500;
+    let baseVersion = (songData && songData.version) ? songData.version : 1;
+    let draftRevision = (songData && songData.draft_revision) ? songData.draft_revision : 0;
+    let pendingOps = [];
+    let autosaveTimer = null;
+    let patchInFlight = false;
+    let saveInFlight = false;
+    let saveGeneration = 0;
+    let autosaveEnabled = true;
+
     // Audio & Waveform
     const audioUrl = `/audio/${songData.id}`;
     const audio = new Audio(audioUrl);
@@ -178,10 +190,10 @@ document.addEventListener('DOMContentLoaded', () => {
         });
 
         if (minDiff < SNAP_TOLERANCE) {
-            currentMap.add(bestCandidate);
+            addNote(bestCandidate);
         } else {
             const customT = Math.round(t * 100) / 100;
-            currentMap.add(customT);
+            addNote(customT);
         }
         draw();
     }
@@ -314,7 +326,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // 1. Check Close to Active (Delete)
         const closestActive = findClosestInSet(currentMap, time);
         if (closestActive !== null && Math.abs(closestActive - time) < toleranceSecs) {
-            currentMap.delete(closestActive);
+            removeNote(closestActive);
             draw();
             return;
         }
@@ -322,7 +334,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // 2. Check Close to Beat Ghost (Activate)
         let closestBeat = findClosestInArray(beatTimes, time);
         if (closestBeat !== null && Math.abs(closestBeat - time) < toleranceSecs) {
-            currentMap.add(closestBeat);
+            addNote(closestBeat);
             draw();
             return;
         }
@@ -330,7 +342,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // 3. Check Close to Onset Ghost (Activate)
         let closestOnset = findClosestInArray(onsetTimes, time);
         if (closestOnset !== null && Math.abs(closestOnset - time) < toleranceSecs) {
-            currentMap.add(closestOnset);
+            addNote(closestOnset);
             draw();
             return;
         }
@@ -340,10 +352,77 @@ document.addEventListener('DOMContentLoaded', () => {
         const x = getCanvasCoordinates(e);
         const time = x / PIXELS_PER_SECOND;
         const t = Math.round(time * 100) / 100;
-        currentMap.add(t);
+        addNote(t);
         draw();
     }
 
+    function addNote(t) {
+        if (currentMap.has(t)) return;
+        currentMap.add(t);
+        queueOp({ op: 'add', time: t });
+    }
+
+    function removeNote(t) {
+        if (!currentMap.delete(t)) return;
+        queueOp({ op: 'remove', time: t });
+    }
+
+    function queueOp(op) {
+        if (!autosaveEnabled) return;
+        pendingOps.push(op);
+        scheduleFlush();
+    }
+
+    function scheduleFlush() {
+        clearTimeout(autosaveTimer);
+        autosaveTimer = setTimeout(flushPatch, AUTOSAVE_DELAY_MS);
+    }
+
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') flushPatch();
+    });
+    window.addEventListener('pagehide', flushPatch);
+
+    async function flushPatch() {
+        clearTimeout(autosaveTimer);
+        if (patchInFlight || saveInFlight || !autosaveEnabled || pendingOps.length === 0) return;
+        patchInFlight = true;
+        const ops = pendingOps;
+        const generation = saveGeneration;
+        pendingOps = [];
+
+        try {
+            const res = await fetch(`/patch_beatmap/${songData.id}`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ version: baseVersion, revision: draftRevision, ops: ops }),
+                keepalive: true
+            });
+            const data = await res.json();
+
+            if (generation !== saveGeneration) {
+                // A full save went out meanwhile and already contains these edits
+            } else if (data.status === 'success') {
+                draftRevision = data.revision;
+            } else if (data.status === 'conflict') {
+                // Someone else saved this beatmap; stop autosaving over their changes
+                autosaveEnabled = false;
+                if (confirm("This beatmap was changed elsewhere. Reload to get the latest version?\n(Cancel keeps your edits; use Save & Apply to overwrite.)")) {
+                    window.location.reload();
+                }
+            } else {
+                console.error("Autosave failed:", data.error);
+            }
+        } catch (e) {
+            // Network hiccup: keep the deltas and retry
+            console.error(e);
+            if (generation === saveGeneration) pendingOps = ops.concat(pendingOps);
+        } finally {
+            patchInFlight = false;
+            if (pendingOps.length > 0) scheduleFlush();
+        }
+    }
+
     function findClosestInSet(set, targetTime) {
         let closest = null;
         let minDiff = Infinity;
@@ -368,7 +447,14 @@ document.addEventListener('DOMContentLoaded', () => {
         saveBtn.innerText = "Saving...";
         saveBtn.disabled = true;
 
+        // The full save carries every queued delta; later edits wait for it
         const timestamps = Array.from(currentMap);
+        clearTimeout(autosaveTimer);
+        const queued = pendingOps;
+        pendingOps = [];
+        saveGeneration++;
+        saveInFlight = true;
+        let saved = false;
 
         try {
             const res = await fetch(`/save_beatmap/${songData.id}`, {
@@ -379,6 +465,11 @@ document.addEventListener('DOMContentLoaded', () => {
             const data = await res.json();
 
             if (data.status === 'success') {
+                // Full save replaces the draft
+                baseVersion = data.version;
+                draftRevision = 0;
+                autosaveEnabled = true;
+                saved = true;
                 saveBtn.innerText = "Saved!";
                 setTimeout(() => {
                     saveBtn.innerHTML = '<span class="material-symbols-outlined">save</span> Save & Apply';
@@ -392,6 +483,11 @@ document.addEventListener('DOMContentLoaded', () => {
             console.error(e);
             alert("Network error.");
             saveBtn.disabled = false;
+        } finally {
+            saveInFlight = false;
+            // Edits made while saving go to the new draft; a failed save keeps its deltas
+            if (!saved) pendingOps = queued.concat(pendingOps);
+            if (pendingOps.length > 0) scheduleFlush();
         }
     }
 });
@@ -196,6 +196,8 @@ class Game {
 
         this.totalNotes = data.beat_map.length; // Fallback if array
         if (data.beat_map && data.beat_map.notes) this.totalNotes = data.beat_map.notes.length;
+        // Windowed beatmaps only carry the first window of notes
+        if (data.beat_map && data.beat_map.note_count !== undefined) this.totalNotes = data.beat_map.note_count;
 
         this.updateUI();
 
@@ -211,14 +213,22 @@ class Game {
             beatMapNotes = data.beat_map.notes;
         }
 
-        this.notes = beatMapNotes.map(n => ({
-            ...n,
-            time: n.time * 1000,
-            hit: false,
-            element: null
-        }));
+        this.notes = beatMapNotes.map(n => this.toGameNote(n));
 
-        if (this.notes.length > 0) {
+        // Notes are streamed in time windows: the server sent [start, window_end)
+        // and the next window is fetched while this one is still playing
+        this.videoId = videoId;
+        this.tier = data.beat_map ? data.beat_map.tier : null;
+        this.windowSize = (data.beat_map && data.beat_map.window) || 0;
+        this.loadedUntil = (data.beat_map && data.beat_map.window_end !== undefined)
+            ? data.beat_map.window_end * 1000
+            : Infinity;
+        this.fetchingWindow = false;
+        this.windowRetryAt = 0;
+
+        if (data.beat_map && data.beat_map.last_note_time !== undefined) {
+            this.lastNoteTime = data.beat_map.last_note_time * 1000;
+        } else if (this.notes.length > 0) {
             // Find the last note time (assuming sorted, but being safe)
             this.lastNoteTime = this.notes.reduce((max, n) => Math.max(max, n.time), 0);
         }
@@ -312,6 +322,7 @@ class Game {
 
 
         const spawnWindow = syncTime + this.travelTime;
+        this.prefetchNotes(syncTime);
 
         this.notes.forEach(note => {
             if (!note.element && !note.hit && note.time <= spawnWindow && note.time > syncTime - 200) {
@@ -404,6 +415,46 @@ class Game {
         }
     }
 
+    toGameNote(n) {
+        return {
+            ...n,
+            time: n.time * 1000,
+            hit: false,
+            element: null
+        };
+    }
+
+    prefetchNotes(syncTime) {
+        const prefetchLead = 10000; // start loading the next window 10s before notes run out
+        if (this.fetchingWindow || this.loadedUntil > this.lastNoteTime) return;
+        if (syncTime + this.travelTime + prefetchLead < this.loadedUntil) return;
+        if (performance.now() < this.windowRetryAt) return;
+
+        // After a jump past the loaded range, continue from the playhead instead
+        const from = Math.max(this.loadedUntil, syncTime);
+        const params = new URLSearchParams({ t: from / 1000, window: this.windowSize });
+        if (this.tier) params.set('tier', this.tier);
+
+        this.fetchingWindow = true;
+        fetch(`/beatmap_window/${this.videoId}?${params}`)
+            .then(response => response.ok ? response.json() : Promise.reject(new Error(`HTTP ${response.status}`)))
+            .then(win => {
+                // Drop finished notes and ones that can no longer spawn, so only
+                // about two windows are ever held in memory
+                const cutoff = this.audio.currentTime * 1000 - this.calibrationOffset - 200;
+                this.notes = this.notes.filter(n => n.element || (!n.hit && n.time > cutoff));
+                win.notes.forEach(n => this.notes.push(this.toGameNote(n)));
+                this.loadedUntil = win.window_end * 1000;
+            })
+            .catch(e => {
+                console.error("Failed to load beatmap window:", e);
+                this.windowRetryAt = performance.now() + 2000;
+            })
+            .finally(() => {
+                this.fetchingWindow = false;
+            });
+    }
+
     createNoteElement(note) {
         const el = document.createElement('div');
         el.className = 'note';
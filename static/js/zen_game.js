@@ -28,8 +28,6 @@ class ZenGame {
         this.wordPatternHistory = []; // Recent rhythm patterns
 
         // Beat/onset data
-        this.beatTimes = [];
-        this.onsetTimes = [];
         this.allRhythmPoints = [];
         this.firstBeatTime = 0;
 
@@ -138,25 +136,13 @@ class ZenGame {
             bgEl.style.backgroundImage = `url(${data.thumbnail})`;
         }
 
-        // Get beat and onset times
-        this.beatTimes = (data.analysis && data.analysis.beat_times) || [];
-        this.onsetTimes = (data.analysis && data.analysis.onset_times) || [];
-
-        // Combine and sort
-        this.allRhythmPoints = [...this.beatTimes, ...this.onsetTimes].sort((a, b) => a - b);
-
-        // Filter close points
-        const filtered = [];
-        let lastTime = -1;
-        for (let t of this.allRhythmPoints) {
-            if (t - lastTime > 0.15) {
-                filtered.push(t);
-                lastTime = t;
-            }
+        // Merged, sorted and gap-filtered rhythm grid is precomputed server-side
+        this.allRhythmPoints = data.rhythm_grid || [];
+        if (data.first_beat !== undefined && data.first_beat !== null) {
+            this.firstBeatTime = data.first_beat;
+        } else {
+            this.firstBeatTime = this.allRhythmPoints.length > 0 ? this.allRhythmPoints[0] : 0;
         }
-        this.allRhythmPoints = filtered;
-
-        this.firstBeatTime = this.beatTimes.length > 0 ? this.beatTimes[0] : (this.allRhythmPoints.length > 0 ? this.allRhythmPoints[0] : 0);
 
         // Start with first word hidden
         this.currentWordEl.style.opacity = '0';
@@ -4,7 +4,8 @@ import json
 from sqlalchemy import create_engine, MetaData, Table
 from sqlalchemy.orm import sessionmaker
 from app import app
-from models import db, Song
+from models import db, Song, FingerprintBand, AudioChunk
+from migrate_db import upgrade_schema
 
 def sync_to_remote(remote_url):
     print(f"Syncing to {remote_url}...")
@@ -14,12 +15,22 @@ def sync_to_remote(remote_url):
         local_songs = Song.query.all()
         print(f"Found {len(local_songs)} songs locally.")
         local_data = [s.to_dict() for s in local_songs] # This returns dicts, but we need ORM objects or raw insert
+        local_bands = [
+            {'song_id': b.song_id, 'band': b.band, 'key': b.key}
+            for b in FingerprintBand.query.all()
+        ]
 
         # Better: keep them bound or detach them?
         # Let's just read the attribute values we need to copy
         
         songs_to_push = []
         for s in local_songs:
+            # Uploads stored on local disk by older builds get their audio pushed as a blob
+            audio_file = s.audio_file
+            if not audio_file and s.audio_path and os.path.exists(s.audio_path):
+                with open(s.audio_path, 'rb') as f:
+                    audio_file = f.read()
+
             songs_to_push.append({
                 'id': s.id,
                 'title': s.title,
@@ -27,13 +38,23 @@ def sync_to_remote(remote_url):
                 'duration': s.duration,
                 'bpm': s.bpm,
                 'difficulty': s.difficulty,
+                'peak_strain': s.peak_strain,
+                'avg_strain': s.avg_strain,
                 'beat_times': json.dumps(s.beat_times),
                 'onset_times': json.dumps(s.onset_times),
+                'onset_strengths': json.dumps(s.onset_strengths),
                 'beat_map': json.dumps(s.beat_map),
+                'rhythm_grid': json.dumps(s.rhythm_grid),
                 'case_sensitive': s.case_sensitive,
                 'include_spaces': s.include_spaces,
                 'date_added': s.date_added,
-                'audio_file': s.audio_file
+                'audio_file': audio_file,
+                'content_hash': s.content_hash,
+                'duplicate_of': s.duplicate_of,
+                # Scores are tied to the version, so the remote keeps the local one
+                'version': s.version or 1,
+                # SQL NULL, not JSON null, so the remote backfill still finds unfingerprinted songs
+                'fingerprint': json.dumps(s.fingerprint) if s.fingerprint is not None else None
             })
 
     # 2. Connect to Remote
@@ -48,6 +69,7 @@ def sync_to_remote(remote_url):
     try:
         # Check if table exists, if not create
         db.metadata.create_all(remote_engine)
+        upgrade_schema(remote_engine)
         print("Remote tables verified/created.")
         
         count = 0 
@@ -65,10 +87,12 @@ def sync_to_remote(remote_url):
                 update_stmt = text("""
                     UPDATE song SET 
                         title=:title, thumbnail_url=:thumbnail_url, duration=:duration, 
-                        bpm=:bpm, difficulty=:difficulty, beat_times=:beat_times, 
-                        onset_times=:onset_times, beat_map=:beat_map, 
+                        bpm=:bpm, difficulty=:difficulty, peak_strain=:peak_strain, avg_strain=:avg_strain, beat_times=:beat_times, 
+                        onset_times=:onset_times, onset_strengths=:onset_strengths, beat_map=:beat_map, rhythm_grid=:rhythm_grid,
                         case_sensitive=:case_sensitive, include_spaces=:include_spaces,
-                        audio_file=:audio_file
+                        audio_file=:audio_file, content_hash=:content_hash,
+                        duplicate_of=:duplicate_of, fingerprint=:fingerprint, version=:version,
+                        beat_map_revision=COALESCE(beat_map_revision, 1) + 1
                     WHERE id=:id
                 """)
                 remote_session.execute(update_stmt, song_data)
@@ -77,17 +101,35 @@ def sync_to_remote(remote_url):
                 # Insert
                 insert_stmt = text("""
                     INSERT INTO song (
-                        id, title, thumbnail_url, duration, bpm, difficulty, 
-                        beat_times, onset_times, beat_map, case_sensitive, include_spaces, date_added, audio_file
+                        id, title, thumbnail_url, duration, bpm, difficulty, peak_strain, avg_strain,
+                        beat_times, onset_times, onset_strengths, beat_map, rhythm_grid, case_sensitive, include_spaces, date_added, audio_file, content_hash,
+                        duplicate_of, fingerprint, version
                     ) VALUES (
-                        :id, :title, :thumbnail_url, :duration, :bpm, :difficulty, 
-                        :beat_times, :onset_times, :beat_map, :case_sensitive, :include_spaces, :date_added, :audio_file
+                        :id, :title, :thumbnail_url, :duration, :bpm, :difficulty, :peak_strain, :avg_strain,
+                        :beat_times, :onset_times, :onset_strengths, :beat_map, :rhythm_grid, :case_sensitive, :include_spaces, :date_added, :audio_file, :content_hash,
+                        :duplicate_of, :fingerprint, :version
                     )
                 """)
                 remote_session.execute(insert_stmt, song_data)
             count += 1
 
-            
+        # Replace the duplicate index rows of the synced songs
+        synced_ids = [song_data['id'] for song_data in songs_to_push]
+        remote_session.execute(FingerprintBand.__table__.delete().where(FingerprintBand.song_id.in_(synced_ids)))
+        if local_bands:
+            remote_session.execute(FingerprintBand.__table__.insert(), local_bands)
+        print(f"Synced {len(local_bands)} fingerprint index rows.")
+
+        # Replace the chunked audio of the synced songs, one chunk at a time
+        remote_session.execute(AudioChunk.__table__.delete().where(AudioChunk.song_id.in_(synced_ids)))
+        chunks = 0
+        with app.app_context():
+            rows = db.session.query(AudioChunk.song_id, AudioChunk.seq, AudioChunk.data).order_by(AudioChunk.song_id, AudioChunk.seq).yield_per(1)
+            for song_id, seq, data in rows:
+                remote_session.execute(AudioChunk.__table__.insert(), {'song_id': song_id, 'seq': seq, 'data': data})
+                chunks += 1
+        print(f"Synced {chunks} audio chunks.")
+
         remote_session.commit()
         print(f"Successfully synced {count} songs.")
         